@@ -0,0 +1,275 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local OpenAI-compatible provider with scripted behaviour.
+
+Serves `POST /v1/chat/completions`, streaming or not, with synthetic
+responses. `--script 429,503,200` makes the first requests fail with the
+given status codes (and a Retry-After header) before succeeding. With
+`--tls` it serves HTTPS with a self-signed certificate, written to the
+given directory, and `--handshake-latency` delays every new connection
+like a distant server would.
+
+    python benchmarks/fake_provider.py --port 8765 --script 429,503 &
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake \\
+        llmsh -m openai/fake "Hello" --debug
+"""
+
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class Behaviour:
+    def __init__(
+        self,
+        script: Optional[list[int]] = None,
+        retry_after: Optional[float] = None,
+        tokens: int = 100,
+        token_rate: float = 0.0,
+        latency: float = 0.0,
+        words: str = "lorem ipsum dolor sit amet consectetur adipiscing elit",
+    ) -> None:
+        self.script = deque(script or [])
+        self.retry_after = retry_after
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.latency = latency
+        # Identical chunks in a row are rejected by litellm as repetition
+        self.words = [f"{word} " for word in words.split()]
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def token(self, i: int) -> str:
+        return self.words[i % len(self.words)]
+
+    def next_status(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.script.popleft() if self.script else 200
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behaviour: Behaviour
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        # What a connection check gets, the connection stays open
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "fake")
+
+        status = self.behaviour.next_status()
+        if status != 200:
+            self._error(status)
+            return
+
+        time.sleep(self.behaviour.latency)
+        if body.get("stream"):
+            self._stream(model)
+        else:
+            self._complete(model)
+
+    def _send_json(self, status: int, payload: dict, headers: dict = {}) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int) -> None:
+        headers = {}
+        if self.behaviour.retry_after is not None:
+            headers["Retry-After"] = str(self.behaviour.retry_after)
+        self._send_json(
+            status,
+            {"error": {"message": f"Scripted {status}", "type": "fake", "code": status}},
+            headers,
+        )
+
+    def _usage(self) -> dict:
+        return {
+            "prompt_tokens": 10,
+            "completion_tokens": self.behaviour.tokens,
+            "total_tokens": 10 + self.behaviour.tokens,
+        }
+
+    def _complete(self, model: str) -> None:
+        content = "".join(self.behaviour.token(i) for i in range(self.behaviour.tokens))
+        self._send_json(200, {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(),
+        })
+
+    def _stream(self, model: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None, **extra) -> None:
+            payload = {
+                "id": "fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        interval = 1 / self.behaviour.token_rate if self.behaviour.token_rate else 0
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for i in range(self.behaviour.tokens):
+                if interval:
+                    time.sleep(interval)
+                chunk({"content": self.behaviour.token(i)})
+            chunk({}, "stop", usage=self._usage())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client has cancelled the stream
+            pass
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class TLSServer(ThreadingHTTPServer):
+    # Handshakes happen in the connection threads, not in the accept loop
+    context: Optional[ssl.SSLContext] = None
+    handshake_latency = 0.0
+    behaviour: Behaviour
+
+    def finish_request(self, request, client_address) -> None:
+        with self.behaviour._lock:
+            self.behaviour.connections += 1
+        if self.handshake_latency:
+            time.sleep(self.handshake_latency)
+        if self.context is not None:
+            try:
+                request = self.context.wrap_socket(request, server_side=True)
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+
+def certificate(directory: str, host: str = "127.0.0.1") -> tuple[str, str]:
+    # Self-signed certificate for the host, clients trust it through
+    # SSL_CERT_FILE
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1",
+            "-subj", f"/CN={host}", "-addext", f"subjectAltName=IP:{host}",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def serve(
+    behaviour: Behaviour,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    tls_dir: Optional[str] = None,
+    handshake_latency: float = 0.0,
+) -> ThreadingHTTPServer:
+    handler = type("ScriptedHandler", (Handler,), {"behaviour": behaviour})
+    server = TLSServer((host, port), handler)
+    server.behaviour = behaviour
+    server.handshake_latency = handshake_latency
+    if tls_dir:
+        server.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server.context.load_cert_chain(*certificate(tls_dir, host))
+    return server
+
+
+def start(
+    behaviour: Behaviour,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    tls_dir: Optional[str] = None,
+    handshake_latency: float = 0.0,
+) -> ThreadingHTTPServer:
+    # Serve in a background thread, `server.server_address` has the port
+    server = serve(behaviour, host, port, tls_dir, handshake_latency)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", default="", help="Status codes to return first, e.g. 429,503.")
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second, 0 for no delay.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token.")
+    parser.add_argument("--tls", metavar="DIR", help="Serve HTTPS, the certificate is written to DIR/cert.pem.")
+    parser.add_argument("--handshake-latency", type=float, default=0.0, help="Seconds every new connection waits.")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(
+        script=[int(s) for s in args.script.split(",") if s],
+        retry_after=args.retry_after,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        latency=args.latency,
+    )
+    server = serve(behaviour, args.host, args.port, args.tls, args.handshake_latency)
+    scheme = "https" if args.tls else "http"
+    print(f"Listening on {scheme}://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
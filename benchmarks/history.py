@@ -0,0 +1,99 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory and per-turn cost of long chat histories.
+
+Builds a history of synthetic messages and reports the memory it takes
+and how long `prepare_context` takes per turn, with and without --limit
+and a token budget. Tokens are estimated from the length, so litellm is
+not involved.
+
+    python benchmarks/history.py --messages 50000
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from llmsh.cli.utils import prepare_context
+from llmsh.models.message import Message
+
+
+def estimate(message: Message) -> int:
+    return message.token_count(lambda m: len(m.content) // 4 + 4)
+
+
+def build(count: int) -> list[Message]:
+    roles = ("user", "assistant")
+    return [
+        Message(role=roles[i % 2], content=f"Message number {i}. " * 10)
+        for i in range(count)
+    ]
+
+
+def per_turn(messages: list[Message], turns: int, **kwargs) -> float:
+    prepare_context(messages, before="System prompt", **kwargs)
+    start = time.perf_counter()
+    for _ in range(turns):
+        prepare_context(messages, before="System prompt", **kwargs)
+    return (time.perf_counter() - start) / turns
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=16_000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    messages = build(args.messages)
+    content = sum(sys.getsizeof(m.content) for m in messages)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    results = [
+        {
+            "case": "memory",
+            "messages": args.messages,
+            "bytes_per_message": (used - content) / args.messages,
+        },
+        {
+            "case": "full",
+            "messages": args.messages,
+            "seconds_per_turn": per_turn(messages, args.turns),
+        },
+        {
+            "case": "limit",
+            "messages": args.messages,
+            "seconds_per_turn": per_turn(messages, args.turns, limit=args.limit),
+        },
+        {
+            "case": "budget",
+            "messages": args.messages,
+            "seconds_per_turn": per_turn(
+                messages, args.turns, budget=args.budget, count_tokens=estimate
+            ),
+        },
+    ]
+    for result in results:
+        print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Import-time budget check for the `llmsh` entry point.
+
+The `llmsh` command runs `llmsh.cli.thin`, which hands the request to a
+running daemon, or otherwise imports the whole CLI from `llmsh.cli.app`.
+Both paths are run under `python -X importtime` several times. The check
+takes the fastest run of each and fails if its cumulative import time is
+over budget or if any of the lazily imported modules were loaded.
+
+    python benchmarks/importtime.py --budget-ms 500 --client-budget-ms 50
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+# Modules that must not be imported until a request is actually sent,
+# or until the option that needs them is given.
+_lazy_modules = (
+    "litellm",
+    "rich.live",
+    "rich.markdown",
+    "sqlite3",
+    "llmsh.cli.cache",
+    "llmsh.cli.engine",
+    "llmsh.cli.history",
+    "llmsh.cli.session",
+)
+
+# Name, statement and the modules it must not import
+_entry_points = (
+    # Paid by every invocation, the thin client sticks to the standard library
+    ("client", "from llmsh.cli.thin import run", _lazy_modules + ("typer", "pydantic", "rich")),
+    # Without a daemon the client imports the CLI before parsing arguments
+    ("local", "from llmsh.cli.thin import run; from llmsh.cli.app import run", _lazy_modules),
+)
+
+
+def parse_importtime(stderr: str, startup: frozenset = frozenset()) -> dict[str, int]:
+    # Each line looks like:
+    # "import time:       385 |      34553 |       pydantic.dataclasses"
+    # Top level imports have exactly one space of indentation. Those in
+    # `startup` are made by the interpreter itself and not counted.
+    cumulative: dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        cumulative[name.strip()] = int(parts[1])
+        if name.startswith("  ") or name.strip() in startup:
+            continue
+        cumulative.setdefault("<total>", 0)
+        cumulative["<total>"] += int(parts[1])
+    return cumulative
+
+
+def measure(entry_point: str, startup: frozenset = frozenset()) -> dict[str, int]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", entry_point],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(proc.stderr, startup)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=500.0, help="Budget without a daemon.")
+    parser.add_argument("--client-budget-ms", type=float, default=50.0, help="Budget of the thin client.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print JSON report.")
+    args = parser.parse_args()
+    budgets = {"client": args.client_budget_ms, "local": args.budget_ms}
+    # Imports of the interpreter and site hooks, before the entry point runs
+    startup = frozenset(measure("pass")) - {"<total>"}
+
+    all_ok = True
+    for name, entry_point, lazy_modules in _entry_points:
+        best: dict[str, int] = {}
+        for _ in range(args.runs):
+            result = measure(entry_point, startup)
+            if not best or result["<total>"] < best["<total>"]:
+                best = result
+
+        total_ms = best["<total>"] / 1000
+        leaked = [m for m in lazy_modules if m in best]
+        top = sorted(
+            ((v, k) for k, v in best.items() if k != "<total>" and k not in startup),
+            reverse=True,
+        )[:10]
+
+        ok = total_ms <= budgets[name] and not leaked
+        all_ok = all_ok and ok
+        if args.json:
+            print(json.dumps({
+                "name": name,
+                "entry_point": entry_point,
+                "total_ms": total_ms,
+                "budget_ms": budgets[name],
+                "leaked": leaked,
+                "top": [{"module": k, "cumulative_ms": v / 1000} for v, k in top],
+                "ok": ok,
+            }))
+        else:
+            print(f"{name} import time: {total_ms:.1f} ms (budget {budgets[name]:.1f} ms)")
+            for v, k in top:
+                print(f"  {v / 1000:8.1f} ms  {k}")
+            if leaked:
+                print(f"eagerly imported: {', '.join(leaked)}")
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
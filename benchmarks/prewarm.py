@@ -0,0 +1,138 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time to the first token of the first chat turn, with and without --prewarm.
+
+Starts `fake_provider.py` over HTTPS with an artificial handshake delay,
+opens `llmsh -i` in a terminal, waits for the prompt, "types" for a
+while and sends a question. Time to the first token comes from
+--metrics-file, so the typing time is not part of it.
+
+    python benchmarks/prewarm.py --handshake-latency 0.3 --typing 2
+"""
+
+import argparse
+import json
+import os
+import platform
+import pty
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.metadata import version
+
+from fake_provider import Behaviour, start
+
+
+def _read_until(fd: int, marker: bytes, timeout: float) -> None:
+    buffer = b""
+    deadline = time.monotonic() + timeout
+    while marker not in buffer:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{marker!r} did not appear: {buffer[-200:]!r}")
+        buffer += os.read(fd, 65536)
+
+
+def first_turn(env: dict, prewarm: bool, typing: float, metrics: str) -> dict:
+    master, slave = pty.openpty()
+    argv = [
+        "-m", "openai/fake", "-i", "--raw", "--no-save",
+        "--metrics-file", metrics,
+        "--prewarm" if prewarm else "--no-prewarm",
+    ]
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "llmsh", *argv],
+        stdin=slave, stdout=slave, stderr=slave, env=env,
+    )
+    os.close(slave)
+    try:
+        _read_until(master, b"> ", timeout=60)
+        time.sleep(typing)
+        os.write(master, b"Hello\n")
+        _read_until(master, b"> ", timeout=60)
+        os.write(master, b"exit\n")
+        # Read the rest, so that the child never blocks on a full terminal
+        try:
+            while os.read(master, 65536):
+                pass
+        except OSError:
+            pass
+        proc.wait(timeout=30)
+    finally:
+        os.close(master)
+        if proc.poll() is None:
+            proc.kill()
+
+    with open(metrics) as f:
+        return json.loads(f.readline())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode, the median is reported.")
+    parser.add_argument("--handshake-latency", type=float, default=0.3, help="Seconds every new connection waits.")
+    parser.add_argument("--typing", type=float, default=2.0, help="Seconds between the prompt and the question.")
+    parser.add_argument("--output", help="Also append the results to this file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        behaviour = Behaviour(tokens=20)
+        server = start(behaviour, tls_dir=home, handshake_latency=args.handshake_latency)
+        host, port = server.server_address[:2]
+
+        env = {k: v for k, v in os.environ.items() if not k.startswith("LLMSH_")}
+        env.update({
+            "OPENAI_API_BASE": f"https://{host}:{port}/v1",
+            "OPENAI_API_KEY": "fake",
+            "SSL_CERT_FILE": os.path.join(home, "cert.pem"),
+            "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+            "LLMSH_DAEMON": "false",
+            "COLUMNS": "100",
+        })
+
+        meta = {
+            "llmsh": version("llmsh"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        }
+        results = []
+        for prewarm in (False, True):
+            runs = []
+            for i in range(args.repeat):
+                metrics = os.path.join(home, f"metrics-{prewarm}-{i}.jsonl")
+                runs.append(first_turn(env, prewarm, args.typing, metrics))
+            results.append({
+                "benchmark": "prewarm",
+                "prewarm": prewarm,
+                "handshake_latency_s": args.handshake_latency,
+                "typing_s": args.typing,
+                "send_s": statistics.median(r["send_s"] for r in runs),
+                "ttft_s": statistics.median(r["ttft_s"] for r in runs),
+                "repeat": args.repeat,
+                **meta,
+            })
+        server.shutdown()
+
+    lines = [json.dumps(result) for result in results]
+    print("\n".join(lines))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write("\n".join(lines) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lookup cost of the semantic cache with many entries.
+
+Fills a temporary cache with synthetic entries embedded by the local
+embedder and reports how long a lookup takes: in a new process, which
+maps the index file, and with entries written after the index was.
+
+Half of the lookups repeat a cached request with different case and
+spacing and should hit. The other half are near misses that must not:
+the same request about a different number, or with one word changed.
+
+    python benchmarks/semantic.py --entries 100000
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from llmsh.cli.semantic import HashingEmbedder, SemanticCache, request_parts
+from llmsh.settings import settings
+
+
+_system = (
+    "You are a helpful assistant in the terminal. Answer briefly and "
+    "format the answer as Markdown."
+)
+
+
+def prompt(i: int, verb: str = "failed") -> str:
+    return f"Explain this error: request {i} {verb} with code {i % 97} in module_{i % 1013}"
+
+
+def context(text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": _system},
+        {"role": "user", "content": text},
+    ]
+
+
+def similar(i: int) -> str:
+    return "  ".join(prompt(i).upper().split())
+
+
+def near_misses(i: int) -> list[str]:
+    return [prompt(i + 1_000_000_000), prompt(i, verb="timed out")]
+
+
+def open_cache(directory: Path) -> SemanticCache:
+    return SemanticCache(
+        directory,
+        HashingEmbedder(),
+        threshold=settings.semantic_threshold,
+        ttl=3600,
+        max_bytes=1 << 40,
+    )
+
+
+def fill(cache: SemanticCache, start: int, count: int) -> None:
+    # Written directly, eviction on every 32nd write would dominate
+    now = time.time()
+    rows = []
+    for i in range(start, start + count):
+        text, scope = request_parts(context(prompt(i)), model="fake", max_tokens=None)
+        vector = cache._unit(cache.embedder.embed(text))
+        rows.append((scope, vector.tobytes(), f"Answer {i}", 100, now, now))
+    cache._db.executemany(
+        "INSERT INTO entries (scope, vector, content, size, created, accessed) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def per_lookup(cache: SemanticCache, lookups: int) -> dict:
+    hits = false_hits = misses = 0
+    start = time.perf_counter()
+    for i in range(lookups):
+        n = i * 7 + 1
+        hits += cache.get(context(similar(n)), model="fake", max_tokens=None) is not None
+        for text in near_misses(n):
+            false_hits += cache.get(context(text), model="fake", max_tokens=None) is not None
+            misses += 1
+    return {
+        "seconds_per_lookup": (time.perf_counter() - start) / (lookups + misses),
+        "hit_rate": hits / lookups,
+        "false_hit_rate": false_hits / misses,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--recent", type=int, default=200, help="Entries written after the index.")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        cache = open_cache(directory)
+        fill(cache, 0, args.entries)
+
+        start = time.perf_counter()
+        cache._snapshot()
+        results.append({
+            "case": "write_index",
+            "entries": args.entries,
+            "seconds": time.perf_counter() - start,
+        })
+        cache.close()
+
+        # A new process maps the index on its first lookup
+        cache = open_cache(directory)
+        start = time.perf_counter()
+        cache.get(context(prompt(1)), model="fake", max_tokens=None)
+        results.append({
+            "case": "first_lookup",
+            "entries": args.entries,
+            "seconds": time.perf_counter() - start,
+        })
+
+        results.append({
+            "case": "lookup",
+            "entries": args.entries,
+            **per_lookup(cache, args.lookups),
+        })
+
+        fill(cache, args.entries, args.recent)
+        results.append({
+            "case": "lookup_with_recent",
+            "entries": args.entries + args.recent,
+            "recent": args.recent,
+            **per_lookup(cache, args.lookups),
+        })
+        cache.close()
+
+    for result in results:
+        print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
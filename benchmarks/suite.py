@@ -0,0 +1,283 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end benchmarks of the CLI against a local fake provider.
+
+Starts `fake_provider.py` in a background thread and runs `llmsh` as a
+subprocess against it, the way it is used from a shell:
+
+- startup: wall and CPU time of a one token response
+- stream: CPU per token of a long streamed response, raw and markdown
+- chat: peak RSS and CPU per token of a long interactive chat
+- stdin: throughput of a multi-megabyte pipe
+
+Every result is printed as a JSON line, together with the llmsh and
+Python versions, so runs of different releases can be compared.
+
+    python benchmarks/suite.py --output results.jsonl
+"""
+
+import argparse
+import json
+import os
+import platform
+import pty
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from importlib.metadata import version
+from typing import Optional
+
+from fake_provider import Behaviour, start
+
+
+BENCHMARKS = ("startup", "stream", "chat", "stdin")
+
+
+def _drain(fd: int) -> None:
+    # Read the terminal side until the child closes it
+    try:
+        while os.read(fd, 65536):
+            pass
+    except OSError:
+        pass
+
+
+def _type(fd: int, text: str) -> None:
+    os.write(fd, text.encode("utf-8"))
+
+
+def run_cli(
+    argv: list[str],
+    env: dict[str, str],
+    stdin_path: Optional[str] = None,
+    typed: Optional[str] = None,
+    tty_output: bool = False,
+) -> dict:
+    """Run llmsh once and return its wall time, CPU time and peak RSS.
+
+    `typed` is written to a terminal attached to stdin, which is what
+    interactive mode needs. With `tty_output` stdout is a terminal too,
+    so the markdown renderer is used instead of raw output.
+    """
+    master = slave = None
+    if typed is not None or tty_output:
+        master, slave = pty.openpty()
+
+    stdin = subprocess.DEVNULL
+    if typed is not None:
+        stdin = slave
+    elif stdin_path:
+        stdin = open(stdin_path, "rb")
+
+    threads = []
+    with tempfile.TemporaryFile() as stderr:
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "llmsh", *argv],
+            stdin=stdin,
+            stdout=slave if tty_output else subprocess.DEVNULL,
+            stderr=stderr,
+            env=env,
+        )
+        if master is not None:
+            os.close(slave)
+            threads.append(threading.Thread(target=_drain, args=(master,), daemon=True))
+            if typed is not None:
+                threads.append(threading.Thread(target=_type, args=(master, typed), daemon=True))
+            for thread in threads:
+                thread.start()
+
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        if master is not None:
+            os.close(master)
+        if stdin_path and typed is None:
+            stdin.close()
+
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(
+                f"llmsh {' '.join(argv)} exited with {proc.returncode}:\n"
+                + stderr.read().decode("utf-8", "replace")
+            )
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "wall_s": wall,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        "max_rss_bytes": max_rss,
+    }
+
+
+def summarize(runs: list[dict]) -> dict:
+    # Median of every measurement over the repeats
+    return {
+        key: statistics.median(run[key] for run in runs) for key in runs[0]
+    } | {"repeat": len(runs)}
+
+
+def bench_startup(behaviour: Behaviour, env: dict, args: argparse.Namespace) -> dict:
+    behaviour.tokens = 1
+    behaviour.latency = 0.0
+    behaviour.token_rate = 0.0
+    runs = [
+        run_cli(["-m", "openai/fake", "Hello", "--raw"], env)
+        for _ in range(args.repeat)
+    ]
+    return summarize(runs)
+
+
+def bench_stream(
+    behaviour: Behaviour, env: dict, args: argparse.Namespace, baseline: dict
+) -> list[dict]:
+    behaviour.tokens = args.tokens
+    behaviour.latency = args.latency
+    behaviour.token_rate = args.token_rate
+
+    results = []
+    for mode in ("raw", "markdown"):
+        argv = ["-m", "openai/fake", "Hello"]
+        if mode == "raw":
+            argv.append("--raw")
+        runs = [
+            run_cli(argv, env, tty_output=mode == "markdown")
+            for _ in range(args.repeat)
+        ]
+        result = summarize(runs)
+        results.append({
+            "mode": mode,
+            "tokens": args.tokens,
+            **result,
+            # Startup cost is paid once per run, not per token
+            "cpu_us_per_token": (result["cpu_s"] - baseline["cpu_s"]) / args.tokens * 1e6,
+        })
+    return results
+
+
+def bench_chat(
+    behaviour: Behaviour, env: dict, args: argparse.Namespace, baseline: dict
+) -> dict:
+    behaviour.tokens = args.chat_tokens
+    behaviour.latency = 0.0
+    behaviour.token_rate = 0.0
+
+    typed = "".join(f"Question number {i}\n" for i in range(args.turns)) + "exit\n"
+    result = run_cli(
+        ["-m", "openai/fake", "-i", "--raw", "--no-save"], env, typed=typed
+    )
+    tokens = args.turns * args.chat_tokens
+    return {
+        "turns": args.turns,
+        "tokens": tokens,
+        **result,
+        "cpu_us_per_token": (result["cpu_s"] - baseline["cpu_s"]) / tokens * 1e6,
+    }
+
+
+def bench_stdin(behaviour: Behaviour, env: dict, args: argparse.Namespace) -> dict:
+    behaviour.tokens = 1
+    behaviour.latency = 0.0
+    behaviour.token_rate = 0.0
+
+    line = b"2024-01-01 12:00:00 INFO some log line with a bit of text in it\n"
+    size = args.stdin_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(suffix=".log") as f:
+        f.write(line * (size // len(line)))
+        f.flush()
+        size = f.tell()
+        runs = [
+            run_cli(["-m", "openai/fake", "Summarize", "--raw"], env, stdin_path=f.name)
+            for _ in range(args.repeat)
+        ]
+    result = summarize(runs)
+    return {
+        "bytes": size,
+        **result,
+        "bytes_per_s": size / result["wall_s"],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", choices=BENCHMARKS, action="append", help="Run only this benchmark, can be repeated.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the median is reported.")
+    parser.add_argument("--tokens", type=int, default=2000, help="Tokens in the streamed response.")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second, 0 for no delay.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token.")
+    parser.add_argument("--turns", type=int, default=100, help="Turns in the chat benchmark.")
+    parser.add_argument("--chat-tokens", type=int, default=200, help="Tokens in every chat response.")
+    parser.add_argument("--stdin-mb", type=int, default=16, help="Size of the piped input in megabytes.")
+    parser.add_argument("--output", help="Also append the results to this file.")
+    args = parser.parse_args()
+    only = args.only or BENCHMARKS
+
+    behaviour = Behaviour()
+    server = start(behaviour)
+    host, port = server.server_address[:2]
+
+    with tempfile.TemporaryDirectory() as home:
+        # A clean environment, so that user settings don't skew the results.
+        # Every run is a cold local process, never one served by a daemon.
+        env = {k: v for k, v in os.environ.items() if not k.startswith("LLMSH_")}
+        env.update({
+            "LLMSH_DAEMON": "false",
+            "OPENAI_API_BASE": f"http://{host}:{port}/v1",
+            "OPENAI_API_KEY": "fake",
+            "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+            "XDG_CACHE_HOME": os.path.join(home, "cache"),
+            "XDG_DATA_HOME": os.path.join(home, "data"),
+            "COLUMNS": "100",
+        })
+
+        meta = {
+            "llmsh": version("llmsh"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        }
+        results = []
+
+        # Startup is the baseline subtracted from the per token numbers
+        baseline = bench_startup(behaviour, env, args)
+        if "startup" in only:
+            results.append({"benchmark": "startup", **baseline})
+        if "stream" in only:
+            results += [
+                {"benchmark": "stream", **r}
+                for r in bench_stream(behaviour, env, args, baseline)
+            ]
+        if "chat" in only:
+            results.append({"benchmark": "chat", **bench_chat(behaviour, env, args, baseline)})
+        if "stdin" in only:
+            results.append({"benchmark": "stdin", **bench_stdin(behaviour, env, args)})
+
+    server.shutdown()
+
+    lines = [json.dumps({**result, **meta}) for result in results]
+    print("\n".join(lines))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write("\n".join(lines) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Output throughput of the client in raw and markdown modes.
+
+Feeds a synthetic markdown response, split into small chunks the way a
+provider streams it, through each output mode and reports bytes per
+second. Output goes to an in-memory file, so only the client is measured.
+
+    python benchmarks/throughput.py --size 200000 --chunk 4
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+
+from rich.console import Console
+
+from llmsh.cli.renderer import MarkdownStream, RawStream
+
+
+def synthetic_response(size: int) -> str:
+    blocks = [
+        "Some paragraph text with **bold** and `code` in it. " * 4,
+        "- first item\n- second item\n- third item",
+        "```python\ndef f(x):\n    return x * 2\n```",
+        "## A heading",
+    ]
+    parts: list[str] = []
+    total = 0
+    while total < size:
+        block = blocks[len(parts) % len(blocks)] + "\n\n"
+        parts.append(block)
+        total += len(block)
+    return "".join(parts)[:size]
+
+
+def chunked(text: str, chunk: int) -> list[str]:
+    return [text[i:i + chunk] for i in range(0, len(text), chunk)]
+
+
+def run_raw(chunks: list[str], flush_bytes: int) -> None:
+    with RawStream(io.BytesIO(), flush_bytes) as stream:
+        for part in chunks:
+            stream.feed(part)
+
+
+def run_markdown(chunks: list[str], min_interval: float) -> None:
+    console = Console(file=io.StringIO(), force_terminal=True, width=100)
+    with MarkdownStream(console, min_interval=min_interval) as stream:
+        for part in chunks:
+            stream.feed(part)
+
+
+def measure(name: str, f, chunks: list[str], size: int) -> dict:
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    f(chunks)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    return {
+        "mode": name,
+        "bytes": size,
+        "chunks": len(chunks),
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "bytes_per_s": size / wall if wall else float("inf"),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--chunk", type=int, default=4)
+    parser.add_argument("--flush-bytes", type=int, default=0)
+    parser.add_argument("--min-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    text = synthetic_response(args.size)
+    chunks = chunked(text, args.chunk)
+    size = len(text.encode("utf-8"))
+
+    results = [
+        measure("raw", lambda c: run_raw(c, args.flush_bytes), chunks, size),
+        measure("markdown", lambda c: run_markdown(c, args.min_interval), chunks, size),
+    ]
+    for result in results:
+        print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,3 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+
+__all__ = ["stream"]
+
+
+def __getattr__(name: str):
+    # Imported on first use, so that starting the CLI stays fast
+    if name == "stream":
+        from llmsh.cli.engine import stream
+
+        return stream
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
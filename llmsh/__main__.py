@@ -13,7 +13,7 @@
 # limitations under the License.
 
 
-from llmsh.cli.app import run
+from llmsh.cli.thin import run
 
 
 if __name__ == "__main__":
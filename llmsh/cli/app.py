@@ -12,24 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import logging
 import os
+import signal
 import sys
-import threading
+from contextlib import ExitStack
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Optional
 
-import litellm
 import typer
-from rich.live import Live
-from rich.markdown import Markdown
 
-from llmsh.cli import params, utils
-from llmsh.cli.renderer import console
+from llmsh.cli import client, fanout, hedge, mapreduce, params, pipeline, utils
+from llmsh.cli.attach import (
+    BYTES_PER_TOKEN,
+    AttachmentError,
+    Attachments,
+    attachment_limit,
+)
+from llmsh.cli.renderer import MarkdownStream, NullStream, RawStream, console
+from llmsh.cli.compact import Compactor
 from llmsh.cli.error_handler import handle_exceptions
+from llmsh.cli.events import EventWriter, ResponseEvents
+from llmsh.cli.stats import RequestStats
+from llmsh.cli.tokens import TokenCounter, context_budget
 from llmsh.models.message import Message
-from llmsh.settings import settings
+from llmsh.settings import load_seconds, settings
+
+# Modules that bring in sqlite3 and asyncio are imported once they are
+# needed, like litellm and the rendering modules
+if TYPE_CHECKING:
+    from llmsh.cli.cache import ResponseCache
+    from llmsh.cli.history import SearchIndex
+    from llmsh.cli.semantic import SemanticCache
+    from llmsh.cli.session import Session
 
 
-litellm.suppress_debug_info = True
 logging.basicConfig(
     level=logging.ERROR,
     stream=sys.stderr,
@@ -43,36 +61,114 @@ logger = logging.getLogger(__name__)
 def loop(
     prompt: params.prompt = settings.prompt,
     model: params.model = settings.model,
+    fallback: params.fallback = settings.fallback,
+    compare: params.compare = settings.compare,
+    hedge_after: params.hedge_after = settings.hedge_after,
     before: params.before = settings.before,
     after: params.after = settings.after,
     limit: params.limit = settings.limit,
+    context_tokens: params.context_tokens = settings.context_tokens,
+    attach_bytes: params.attach_bytes = settings.attach_bytes,
+    compact: params.compact = settings.compact,
+    compact_model: params.compact_model = settings.compact_model,
+    prompt_cache: params.prompt_cache = settings.prompt_cache,
     max_tokens: params.tokens = settings.max_tokens,
+    retries: params.retries = settings.retries,
+    rate_limit: params.rate_limit = settings.rate_limit,
     no_stream: params.no_stream = settings.no_stream,
     interactive: params.interactive = settings.interactive,
+    resume: params.resume = settings.resume,
+    prewarm: params.prewarm = settings.prewarm,
+    save: params.save = settings.save,
     debug: params.debug = settings.debug,
+    each_line: params.each_line = settings.each_line,
+    each_record: params.each_record = settings.each_record,
+    map_reduce: params.map_reduce = settings.map_reduce,
+    chunk_tokens: params.chunk_tokens = settings.chunk_tokens,
+    chunk_overlap: params.chunk_overlap = settings.chunk_overlap,
+    jobs: params.jobs = settings.jobs,
+    raw: params.raw = settings.raw,
+    flush_bytes: params.flush_bytes = settings.flush_bytes,
+    cache: params.cache = settings.cache,
+    semantic_cache: params.semantic_cache = settings.semantic_cache,
+    semantic_threshold: params.semantic_threshold = settings.semantic_threshold,
+    embedding_model: params.embedding_model = settings.embedding_model,
+    cache_ttl: params.cache_ttl = settings.cache_ttl,
+    cache_size: params.cache_size = settings.cache_size,
+    stats: params.stats = settings.stats,
+    metrics_file: params.metrics_file = settings.metrics_file,
+    output_format: params.output_format = settings.output_format,
+    output: params.output = settings.output,
 ):
     if debug:
         logging.root.setLevel(logging.DEBUG)
 
     logger.debug(f"prompt: {prompt}")
     logger.debug(f"model: {model}")
+    logger.debug(f"fallback: {fallback}")
+    logger.debug(f"compare: {compare}")
+    logger.debug(f"hedge_after: {hedge_after}")
     logger.debug(f"before: {before}")
     logger.debug(f"after: {after}")
     logger.debug(f"limit: {limit}")
+    logger.debug(f"context_tokens: {context_tokens}")
+    logger.debug(f"attach_bytes: {attach_bytes}")
+    logger.debug(f"compact: {compact}")
+    logger.debug(f"compact_model: {compact_model}")
+    logger.debug(f"prompt_cache: {prompt_cache}")
     logger.debug(f"max_tokens: {max_tokens}")
+    logger.debug(f"retries: {retries}")
+    logger.debug(f"rate_limit: {rate_limit}")
     logger.debug(f"no_stream: {no_stream}")
     logger.debug(f"interactive: {interactive}")
+    logger.debug(f"resume: {resume}")
+    logger.debug(f"prewarm: {prewarm}")
+    logger.debug(f"save: {save}")
+    logger.debug(f"each_line: {each_line}")
+    logger.debug(f"each_record: {each_record}")
+    logger.debug(f"map_reduce: {map_reduce}")
+    logger.debug(f"chunk_tokens: {chunk_tokens}")
+    logger.debug(f"chunk_overlap: {chunk_overlap}")
+    logger.debug(f"jobs: {jobs}")
+    logger.debug(f"raw: {raw}")
+    logger.debug(f"flush_bytes: {flush_bytes}")
+    logger.debug(f"cache: {cache}")
+    logger.debug(f"semantic_cache: {semantic_cache}")
+    logger.debug(f"semantic_threshold: {semantic_threshold}")
+    logger.debug(f"embedding_model: {embedding_model}")
+    logger.debug(f"cache_ttl: {cache_ttl}")
+    logger.debug(f"cache_size: {cache_size}")
+    logger.debug(f"stats: {stats}")
+    logger.debug(f"metrics_file: {metrics_file}")
+    logger.debug(f"output_format: {output_format}")
+    logger.debug(f"output: {output}")
+
+    # Resuming a session only makes sense in chat mode
+    if resume:
+        interactive = True
+
+    # Events replace the rendered response on stdout
+    jsonl = output_format == "jsonl"
+    if jsonl and interactive:
+        console.print("[red]--output-format jsonl is not supported in chat mode.[/red]")
+        raise typer.Exit(1)
+    if (jsonl or output) and (compare or each_line or each_record):
+        console.print("[red]--output-format jsonl and --output are not supported with --compare, --each-line and --each-record.[/red]")
+        raise typer.Exit(1)
+
+    # Files referenced in prompts, shared by all turns of a chat
+    attachments = Attachments(attachment_limit(attach_bytes, context_tokens))
 
     # Determine before prompt
-    if text_from_file := utils.read_if_path(before):
+    if text_from_file := utils.read_if_path(before, attachments):
         before = text_from_file
 
     # Determine initial prompt
-    if text_from_file := utils.read_if_path(prompt):
+    if text_from_file := utils.read_if_path(prompt, attachments):
         prompt = text_from_file
 
     # Determine after prompt
-    if text_from_file := utils.read_if_path(after):
+    if text_from_file := utils.read_if_path(after, attachments):
         after = text_from_file
 
     is_pipe = not os.isatty(sys.stdin.fileno())
@@ -86,130 +182,549 @@ def loop(
             console.print("[red]Pipe mode is not supported in chat mode.[/red]")
             raise typer.Exit()
         
-        # Read from pipe if available
-        pipe_prompt = ""
-        try:
-            while True:
-                pipe_prompt += input()
-        except EOFError:
-            pass
-        logger.debug(f"pipe_prompt: {pipe_prompt}")
-
-        # Append pipe prompt to the user prompt
-        if prompt:
-            prompt += f"\n{pipe_prompt}"
-        else:
-            prompt = pipe_prompt
+        if each_line or each_record:
+            # Every line or record becomes a separate request
+            separator = b"\0" if each_record else b"\n"
 
-    keyboard_interrupt_event = threading.Event()
-    exit_event = threading.Event()
-    in_progress_event = threading.Event()
+            def complete(record: str) -> str:
+                return client.complete_prompt(
+                    prompt=pipeline.join_prompt(prompt, record),
+                    model=model,
+                    before=before,
+                    after=after,
+                    max_tokens=max_tokens,
+                    retries=retries,
+                    rate_limit=rate_limit,
+                )
 
-    messages: list[Message] = []
-    while True:
-        keyboard_interrupt_event.clear()
-        exit_event.clear()
-        in_progress_event.clear()
+            def write(content: str) -> None:
+                sys.stdout.buffer.write(content.encode("utf-8") + separator)
+                sys.stdout.buffer.flush()
 
-        try:
-            if not prompt:
-                if interactive:
-                    prompt = console.input("> ")
-                    logger.debug(f"input_prompt: {prompt}")
-                else:
-                    console.print("[red]Non-interactive mode requires a prompt.[/red]")
-                    raise typer.Exit(1)
-                
-            # Quit if "exit" or "quit" is entered
-            if interactive:
-                utils.quit_on_request(prompt)
-
-            # Prepare context
-            messages.append(Message(role=settings.user_role, content=prompt))
-            context = utils.prepare_context(
-                messages=messages,
-                before=before,
-                after=after,
-                limit=limit,
+            pipeline.run_ordered(
+                records=pipeline.iter_records(sys.stdin.buffer, separator),
+                complete=complete,
+                write=write,
+                jobs=jobs,
             )
+            return
 
-            # Request a response from the model
-            in_progress_event.set()
-            response = litellm.completion(
+        if map_reduce:
+            # Chunks are read from the pipe as they are sent
+            size = chunk_tokens * BYTES_PER_TOKEN
+            prompt = mapreduce.map_reduce(
+                chunks=pipeline.iter_chunks(
+                    sys.stdin.buffer, size, chunk_overlap * BYTES_PER_TOKEN
+                ),
+                prompt=prompt,
                 model=model,
-                messages=context,
-                stream=not no_stream,
+                size=size,
+                before=before,
+                after=after,
                 max_tokens=max_tokens,
+                retries=retries,
+                rate_limit=rate_limit,
+                jobs=jobs,
             )
+            logger.debug(f"prompt: {prompt}")
+
+        else:
+            # Read from pipe if available
+            pipe_prompt = pipeline.read_all(sys.stdin.buffer).rstrip("\r\n")
+            logger.debug(f"pipe_prompt: {pipe_prompt}")
+
+            # Append pipe prompt to the user prompt
+            prompt = pipeline.join_prompt(prompt, pipe_prompt)
+
+    elif each_line or each_record or map_reduce:
+        console.print("[red]--each-line, --each-record and --map-reduce require piped input.[/red]")
+        raise typer.Exit(1)
+
+    # Skip markdown rendering when the output goes to a file or a program
+    if not raw and not sys.stdout.isatty():
+        logger.debug("Output is not a terminal, switching to raw mode.")
+        raw = True
+
+    # Rendering modules are only needed once a response arrives.
+    from rich.markdown import Markdown
+
+    # The same prompt is sent to several models at once
+    if compare:
+        if interactive:
+            console.print("[red]--compare is not supported in chat mode.[/red]")
+            raise typer.Exit(1)
+        if not prompt:
+            console.print("[red]Non-interactive mode requires a prompt.[/red]")
+            raise typer.Exit(1)
 
-            if no_stream:
-                # Record the arrived response
-                content = response.choices[0].message.content or ""
-                messages.append(Message(role=settings.llm_role, content=content))
+        context = utils.prepare_context(
+            messages=[Message(role=settings.user_role, content=prompt)],
+            before=before,
+            after=after,
+        )
+        succeeded = fanout.fan_out(
+            console,
+            models=fanout.parse_models(compare),
+            context=context,
+            max_tokens=max_tokens,
+            retries=retries,
+            rate_limit=rate_limit,
+            raw=raw,
+            stats=stats,
+            metrics_file=metrics_file,
+        )
+        if not succeeded:
+            raise typer.Exit(1)
+        return
+
+    # Everything opened from here on is closed on every way out,
+    # including typer.Exit on "exit" and on errors
+    with ExitStack() as stack:
+        response_cache: Optional["ResponseCache"] = None
+        if cache:
+            from llmsh.cli.cache import ResponseCache, cache_dir
+
+            response_cache = ResponseCache(
+                path=cache_dir() / "responses.sqlite3",
+                ttl=cache_ttl,
+                max_bytes=cache_size * 1024 * 1024,
+            )
+            stack.callback(response_cache.close)
+
+        # Similar requests are found by their embeddings, numpy is optional
+        semantic: Optional["SemanticCache"] = None
+        if semantic_cache:
+            from llmsh.cli.cache import cache_dir
+
+            try:
+                from llmsh.cli.semantic import SemanticCache, get_embedder
+            except ImportError:
+                console.print(
+                    "[red]--semantic-cache requires numpy: pip install 'llmsh[semantic]'[/red]"
+                )
+                raise typer.Exit(1)
+            semantic = SemanticCache(
+                directory=cache_dir() / "semantic",
+                embedder=get_embedder(embedding_model),
+                threshold=semantic_threshold,
+                ttl=cache_ttl,
+                max_bytes=cache_size * 1024 * 1024,
+            )
+            stack.callback(semantic.close)
+
+        # Token budget for the prompt part of the context
+        token_counter: Optional[TokenCounter] = None
+        budget: Optional[int] = None
+        if context_tokens:
+            token_counter = TokenCounter(model)
+            budget = context_budget(token_counter, context_tokens, max_tokens)
+            logger.debug(f"budget: {budget}")
+
+        # Older chat messages are summarized while the user types
+        compactor: Optional[Compactor] = None
+        if interactive and compact:
+            compactor = Compactor(
+                model=compact_model or model,
+                threshold=compact,
+                count_tokens=token_counter or TokenCounter(model),
+                retries=retries,
+                rate_limit=rate_limit,
+            )
+
+        # Models to send requests to, the one that answered last goes first
+        models = hedge.parse_models(model, fallback)
+
+        # Providers that need explicit marks to cache the prompt prefix
+        cache_marks = prompt_cache and client.supports_cache_marks(model)
+        logger.debug(f"cache_marks: {cache_marks}")
+
+        # Events of every response, to stdout and to the --output file
+        event_writers: list[EventWriter] = []
+        if jsonl:
+            event_writers.append(EventWriter(sys.stdout.buffer, flush_bytes))
+        if output:
+            # Buffered, flushed once a response has ended
+            output_file = stack.enter_context(open(output, "wb"))
+            event_writers.append(EventWriter(output_file))
+
+        # Requests and streams of the whole session run on one event loop
+        from llmsh.cli.engine import Engine, iterate_in_thread, pump
+
+        engine = Engine()
+        stack.callback(engine.close)
+        interrupted = exiting = in_progress = False
+
+        def request_exit(signum: int, frame: object) -> None:
+            # Termination stops the response like Ctrl+C and then quits
+            nonlocal exiting
+            exiting = True
+            raise KeyboardInterrupt
+
+        for name in ("SIGTERM", "SIGHUP"):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), request_exit)
+
+        messages: list[Message] = []
+
+        # Chat sessions are saved to an append-only log after every turn
+        session: Optional["Session"] = None
+        search_index: Optional["SearchIndex"] = None
+        if interactive and (save or resume):
+            import sqlite3
+
+            from llmsh.cli.history import open_index
+            from llmsh.cli.session import (
+                Session,
+                last_session_id,
+                load_history,
+                new_session_id,
+                sessions_dir,
+            )
 
-                # Render the markdown
-                markdown = Markdown(content)
-                console.print(markdown)
+            directory = sessions_dir()
+            session_id = resume
+            if resume == "last":
+                session_id = last_session_id(directory)
+            if resume and not (
+                session_id and (directory / f"{session_id}.jsonl").exists()
+            ):
+                console.print(f"[red]Session not found: {resume}[/red]")
+                raise typer.Exit(1)
 
+            session = Session(directory, session_id or new_session_id())
+            stack.callback(session.close)
+            # Saved messages become searchable with `llmsh history search`
+            search_index = open_index(directory)
+            if search_index:
+                stack.callback(search_index.close)
+            if resume:
+                messages = load_history(
+                    session,
+                    limit=limit,
+                    budget=budget,
+                    count_tokens=token_counter,
+                )
+                console.print(
+                    f"[blue]Resumed session {session.id} with {len(session)} messages.[/blue]",
+                    highlight=False,
+                )
             else:
-                # Record a new empty message
-                messages.append(Message(role=settings.llm_role, content=""))
-
-                # Keep updating the markdown renderable with the response
-                # as it comes in.
-                markdown = Markdown(messages[-1].content)
-                with Live(
-                    markdown,
-                    console=console,
-                    refresh_per_second=4,
-                    vertical_overflow="visible",
-                ) as live:
-                    try:
-                        for chunk in response:
-                            if (
-                                keyboard_interrupt_event.is_set()
-                                or exit_event.is_set()
-                            ):
-                                break
-
-                            part = chunk.choices[0].delta.content or ""
-                            messages[-1].content += part
-                            markdown = Markdown(messages[-1].content)
-                            live.update(markdown)
-
-                    except KeyboardInterrupt:
-                        # If the user presses Ctrl+C, we should stop the current
-                        # response and start anew with the next prompt.
-                        keyboard_interrupt_event.set()
-
-            # Erase prompt
-            prompt = ""
+                console.print(f"[blue]Session {session.id}[/blue]", highlight=False)
+        saved = len(messages)
+        while True:
+            interrupted = in_progress = False
+            # The prompt as typed, before the files it references are attached
+            typed: Optional[str] = None
+
+            try:
+                if not prompt:
+                    if interactive:
+                        if prewarm:
+                            # Connect while the user types, without waiting
+                            engine.warm(models)
+                        prompt = typed = console.input("> ")
+                        logger.debug(f"input_prompt: {prompt}")
+
+                        # Files already attached earlier are not sent again
+                        try:
+                            prompt = attachments.expand(prompt)
+                        except AttachmentError as e:
+                            console.print(f"[red]{e}[/red]")
+                            prompt = ""
+                            continue
+                    else:
+                        console.print("[red]Non-interactive mode requires a prompt.[/red]")
+                        raise typer.Exit(1)
+                
+                # Quit if "exit" or "quit" is entered
+                if interactive:
+                    utils.quit_on_request(prompt)
+
+                # Timings are only collected when asked for
+                request_stats: Optional[RequestStats] = None
+                if stats or metrics_file:
+                    request_stats = RequestStats(models[0], load_seconds)
+                    request_stats.start()
+
+                # Prepare context
+                messages.append(Message(role=settings.user_role, content=prompt))
+                history, summary = messages, None
+                if compactor:
+                    summary, covers = compactor.current()
+                    history = messages[covers:]
+                prepare = partial(
+                    utils.prepare_context,
+                    before=before,
+                    after=after,
+                    limit=limit,
+                    budget=budget,
+                    count_tokens=token_counter,
+                    summary=summary,
+                    cache_marks=cache_marks,
+                )
+                context = prepare(history)
+                if typed and not attachments.sent(context):
+                    # The files were attached to a message that is not sent
+                    # any more, because of --limit, the budget or compaction
+                    logger.debug("Attaching files again, their earlier message was dropped.")
+                    messages[-1] = history[-1] = Message(
+                        role=settings.user_role,
+                        content=attachments.expand(typed, dedupe=False),
+                    )
+                    context = prepare(history)
+                if request_stats:
+                    request_stats.prepared()
+                events: Optional[ResponseEvents] = None
+                if event_writers:
+                    events = ResponseEvents(event_writers, models[0])
+
+                # Serve identical requests from the cache if enabled
+                cached: Optional[str] = None
+                if response_cache:
+                    from llmsh.cli.cache import request_key
+
+                    cache_key = request_key(
+                        context, model=models[0], max_tokens=max_tokens
+                    )
+                    cached = response_cache.get(cache_key)
+                # Then similar ones, if enabled
+                if semantic and cached is None:
+                    cache_params = {"model": models[0], "max_tokens": max_tokens}
+                    cached = semantic.get(context, **cache_params)
+
+                # Request a response from the model
+                in_progress = True
+                answered_by = models[0]
+                hedged = len(models) > 1
+                if cached is None:
+                    if request_stats:
+                        request_stats.load(partial(client.load_provider, answered_by))
+                    request = dict(
+                        messages=context,
+                        stream=not no_stream,
+                        max_tokens=max_tokens,
+                        retries=retries,
+                        rate_limit=rate_limit,
+                        include_usage=request_stats is not None or events is not None,
+                    )
+                    if hedged:
+                        # Racing models are requested in threads
+                        answered_by, response = hedge.race(
+                            models,
+                            partial(client.completion, **request),
+                            stream=not no_stream,
+                            hedge_after=hedge_after,
+                        )
+                        models = hedge.prefer(models, answered_by)
+                    else:
+                        response = engine.run(client.acompletion(answered_by, **request))
+                    if request_stats:
+                        request_stats.sent()
+                        request_stats.model = answered_by
+                    if events:
+                        events.model = answered_by
+                else:
+                    if request_stats:
+                        request_stats.cached = True
+                    if events:
+                        events.cached = True
+
+                if no_stream:
+                    # Record the arrived response
+                    if cached is None:
+                        content = response.choices[0].message.content or ""
+                        if request_stats:
+                            request_stats.usage(response)
+                    else:
+                        content = cached
+                    if request_stats:
+                        request_stats.arrived()
+                    if events:
+                        if cached is None:
+                            events.chunk(response)
+                        else:
+                            events.delta(content)
+                        events.end(content)
+                    messages.append(
+                        Message(
+                            role=settings.llm_role,
+                            content=content,
+                            model=answered_by,
+                        )
+                    )
+
+                    # Render the markdown, stdout has the events with jsonl
+                    if raw and not jsonl:
+                        with RawStream(sys.stdout.buffer, flush_bytes) as stream:
+                            feed = stream.feed
+                            if request_stats:
+                                feed = request_stats.timed(feed)
+                            feed(content)
+                    elif not jsonl:
+                        render = console.print
+                        if request_stats:
+                            render = request_stats.timed(render)
+                        render(Markdown(content))
+
+                else:
+                    # Record a new empty message
+                    messages.append(
+                        Message(
+                            role=settings.llm_role,
+                            content="",
+                            model=answered_by,
+                        )
+                    )
+
+                    # Render the response as it comes in. Finished markdown
+                    # blocks are printed once, only the last one is redrawn.
+                    if jsonl:
+                        stream = NullStream()
+                    elif raw:
+                        stream = RawStream(sys.stdout.buffer, flush_bytes)
+                    else:
+                        stream = MarkdownStream(console)
+
+                    # Measuring wrappers replace the plain calls with --stats
+                    feed = stream.feed
+                    chunks = None
+                    if cached is None:
+                        chunks = iterate_in_thread(response) if hedged else response
+                    if request_stats:
+                        feed = request_stats.timed(feed)
+                        if chunks is not None:
+                            chunks = request_stats.atrack(chunks)
+                    if events and chunks is not None:
+                        chunks = events.atrack(chunks)
+
+                    with stream:
+                        try:
+                            if cached is not None:
+                                if request_stats:
+                                    request_stats.arrived()
+                                if events:
+                                    events.delta(cached)
+                                feed(cached)
+                            else:
+                                # The network is read while the terminal renders
+                                engine.run(pump(chunks, feed))
+
+                        except KeyboardInterrupt:
+                            # If the user presses Ctrl+C, we should stop the current
+                            # response and start anew with the next prompt. Closing
+                            # the stream stops the generation on the provider side
+                            # and releases the connection.
+                            interrupted = True
+                            if cached is None:
+                                engine.run(client.aclose_stream(response))
+                            messages[-1].truncated = True
+
+                        finally:
+                            messages[-1].content = stream.text
+                            if request_stats:
+                                request_stats.timed(stream.flush)()
+
+                    if events:
+                        events.end(messages[-1].content, messages[-1].truncated)
+
+                    if messages[-1].truncated and not messages[-1].content:
+                        # Nothing has arrived, the question is dropped too
+                        del messages[-2:]
+
+                # Only complete responses are cached
+                if (
+                    response_cache
+                    and cached is None
+                    and not interrupted
+                ):
+                    response_cache.set(cache_key, messages[-1].content)
+                if (
+                    semantic
+                    and cached is None
+                    and not interrupted
+                ):
+                    semantic.set(context, messages[-1].content, **cache_params)
+
+                if request_stats:
+                    request_stats.finish()
+                    request_stats.report(metrics_file, show=stats)
+
+                # Save the turn
+                if session is not None:
+                    session.append(messages[saved:])
+                    saved = len(messages)
+                    if search_index:
+                        try:
+                            search_index.update(session.id)
+                        except sqlite3.Error as e:
+                            logger.warning(f"Failed to index the turn: {e}")
+
+                if compactor:
+                    compactor.start(messages)
+
+                # Erase prompt
+                prompt = ""
     
-        except KeyboardInterrupt:
-            # If the user presses Ctrl+C, we should stop the current
-            # response and start anew with the next prompt.
-            if in_progress_event.is_set():
-                console.print("[blue]Press Ctrl+D (or Ctrl+Z on Windows) if you want to quit. Typing 'exit' or 'quit' has the same effect.[/blue]")
-
-            continue
-
-        except EOFError:
-            # Quit gracefully on Ctrl+D (or Ctrl+Z on Windows)
-            exit_event.set()
-            break
-
-        if not interactive:
-            # Do not continue in prompt mode
-            break
-        
+            except KeyboardInterrupt:
+                # If the user presses Ctrl+C, we should stop the current
+                # response and start anew with the next prompt.
+                if messages and messages[-1].role == settings.user_role:
+                    # The question was never answered
+                    messages.pop()
+                prompt = ""
 
-def run() -> None:
+                if exiting or not interactive:
+                    break
+
+                if in_progress:
+                    console.print("[blue]Press Ctrl+D (or Ctrl+Z on Windows) if you want to quit. Typing 'exit' or 'quit' has the same effect.[/blue]")
+
+                continue
+
+            except EOFError:
+                # Quit gracefully on Ctrl+D (or Ctrl+Z on Windows)
+                break
+
+            if not interactive or exiting:
+                # Do not continue in prompt mode
+                break
+
+
+# Subcommands are imported only when invoked
+_subcommands = {
+    "batch": ("llmsh.cli.batch", "batch"),
+    "daemon": ("llmsh.cli.daemon", "daemon"),
+    "history": ("llmsh.cli.history", "history"),
+}
+
+
+def make_app(name: str, command: Callable) -> typer.Typer:
     typer_app = typer.Typer(add_completion=False)
     typer_app.command(
-        "default",
+        name,
         context_settings={
             "allow_extra_args": True,
             "help_option_names": ["-h", "--help"],
-        }
-    )(loop)
+        },
+    )(command)
+    return typer_app
+
+
+def run() -> None:
+    # Subcommands are dispatched by hand, so that the default command
+    # keeps accepting a prompt as its first argument.
+    args = sys.argv[1:]
+    if args and args[0] in _subcommands:
+        module_name, function_name = _subcommands[args[0]]
+        module = importlib.import_module(module_name)
+        command = getattr(module, function_name)
+        # Groups of subcommands are apps of their own
+        if isinstance(command, typer.Typer):
+            typer_app = command
+        else:
+            typer_app = make_app(args[0], command)
+        typer_app(args=args[1:], prog_name=f"llmsh {args[0]}")
+        return
+
+    typer_app = make_app("default", loop)
     typer_app()
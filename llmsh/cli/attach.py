@@ -0,0 +1,302 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import re
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+# Directories that are never attached when a directory or a glob is given
+DEFAULT_IGNORE = frozenset({
+    ".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", ".tox",
+})
+# Files larger than this are memory-mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+# A NUL byte in the first block marks a binary file
+BINARY_SNIFF = 8192
+
+# Rough size of a token in English text and code
+BYTES_PER_TOKEN = 4
+
+_reference = re.compile(r"(?<!\S)@(\S+)")
+
+
+class AttachmentError(Exception):
+    pass
+
+
+class IgnoreRules:
+    """Subset of .gitignore: globs, `dir/` and `/anchored` patterns.
+
+    Negations (`!pattern`) are not supported and skipped.
+    """
+
+    def __init__(self) -> None:
+        self._rules: list[tuple[Path, str, bool, bool]] = []
+
+    def load(self, directory: Path) -> None:
+        try:
+            lines = (directory / ".gitignore").read_text().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith(("#", "!")):
+                continue
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            self._rules.append((directory, line.lstrip("/"), dir_only, anchored))
+
+    def ignored(self, path: Path, is_dir: bool) -> bool:
+        if path.name in DEFAULT_IGNORE or path.name.startswith("."):
+            return True
+        for base, pattern, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            try:
+                relative = path.relative_to(base).as_posix()
+            except ValueError:
+                continue
+            if fnmatch(relative if anchored else path.name, pattern):
+                return True
+        return False
+
+
+def attachment_limit(
+    attach_bytes: Optional[int], context_tokens: Optional[int]
+) -> Optional[int]:
+    # Files that can't fit into the context window are not even read
+    if context_tokens:
+        limit = context_tokens * BYTES_PER_TOKEN
+        return min(attach_bytes, limit) if attach_bytes else limit
+    return attach_bytes or None
+
+
+def _fence(content: str) -> str:
+    # Longer than any run of backticks inside the file
+    longest = max((len(m) for m in re.findall(r"`+", content)), default=0)
+    return "`" * max(3, longest + 1)
+
+
+def _is_binary(data: Union[bytes, mmap.mmap]) -> bool:
+    return b"\0" in data[:BINARY_SNIFF]
+
+
+class Attachments:
+    """Files referenced with `@path`, `@glob` or `@dir/` in prompts.
+
+    One instance lives for the whole chat. Files are hashed once per
+    modification and a file that was already attached with the same
+    content is not attached again, as long as the prompt it was attached
+    to is still sent (see `sent`). At most `max_bytes` are read from
+    files referenced by a single prompt.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, cwd: Optional[Path] = None) -> None:
+        self.max_bytes = max_bytes
+        self.cwd = Path(cwd).resolve() if cwd else Path.cwd()
+        # (path, size, mtime, bytes read) -> digest
+        self._digests: dict[tuple[str, int, int, int], str] = {}
+        # path -> digest of the content that was attached and the prompt
+        # it was attached to
+        self._attached: dict[str, tuple[str, str]] = {}
+        # Prompts with the files the last one refers to as attached earlier
+        self._refers_to: list[str] = []
+
+    def expand(self, text: Optional[str], dedupe: bool = True) -> Optional[str]:
+        self._refers_to = []
+        if not text or "@" not in text:
+            return text
+
+        # A whole argument naming a single file is replaced by its content
+        if text.startswith("@"):
+            path = self.cwd / os.path.expanduser(text[1:])
+            if path.is_file():
+                content, size, binary, _ = self._read(path, self.max_bytes)
+                if binary:
+                    raise AttachmentError(f"Given path is not a text file: {path}")
+                if self.max_bytes is not None and size > self.max_bytes:
+                    logger.warning(f"{path} was truncated to {self.max_bytes} bytes.")
+                return content
+
+        references = _reference.findall(text)
+        paths: list[tuple[Path, bool]] = []
+        for reference in references:
+            matches = list(self._resolve(reference))
+            if not matches and text.strip() == f"@{reference}":
+                raise AttachmentError(f"File not found: {reference}")
+            paths += matches
+        if not paths:
+            return text
+
+        # References stay in the prompt, the files follow it
+        remaining = _reference.sub("", text).strip()
+        blocks = [text] if remaining else []
+        attached: dict[str, str] = {}
+        blocks += self._attach(paths, attached, dedupe)
+        expanded = "\n\n".join(blocks)
+        for path, digest in attached.items():
+            self._attached[path] = digest, expanded
+        return expanded
+
+    def sent(self, context: list[dict]) -> bool:
+        # Whether the files the last prompt refers to as attached earlier
+        # are in the context, the prompt has to be expanded again with
+        # `dedupe=False` if they were dropped from it.
+        contents = [m.get("content") for m in context]
+        return all(any(text == c for c in contents) for text in self._refers_to)
+
+    def _resolve(self, reference: str) -> Iterator[tuple[Path, bool]]:
+        # Paths with a flag telling whether they were named explicitly
+        path = self.cwd / os.path.expanduser(reference)
+        if any(c in reference for c in "*?["):
+            rules = IgnoreRules()
+            rules.load(self.cwd)
+            for match in sorted(glob.glob(str(path), recursive=True)):
+                match = Path(match)
+                if match.is_file() and not self._ignored_in_glob(match, rules):
+                    yield match, False
+        elif path.is_dir():
+            yield from ((p, False) for p in self._walk(path.resolve()))
+        elif path.is_file():
+            yield path, True
+
+    def _ignored_in_glob(self, path: Path, rules: IgnoreRules) -> bool:
+        parent = path.parent
+        while parent != self.cwd and self.cwd in parent.parents:
+            if rules.ignored(parent, is_dir=True):
+                return True
+            parent = parent.parent
+        return rules.ignored(path, is_dir=False)
+
+    def _walk(self, root: Path) -> Iterator[Path]:
+        rules = IgnoreRules()
+        # Rules of the enclosing directories apply to the subdirectory too
+        for parent in reversed(root.parents):
+            if parent == self.cwd or self.cwd in parent.parents:
+                rules.load(parent)
+        for directory, dirs, files in os.walk(root):
+            directory = Path(directory)
+            rules.load(directory)
+            dirs[:] = sorted(
+                d for d in dirs if not rules.ignored(directory / d, is_dir=True)
+            )
+            for name in sorted(files):
+                if not rules.ignored(directory / name, is_dir=False):
+                    yield directory / name
+
+    def _attach(
+        self,
+        paths: list[tuple[Path, bool]],
+        attached: dict[str, str],
+        dedupe: bool,
+    ) -> list[str]:
+        blocks: list[str] = []
+        left = self.max_bytes
+        seen: set[Path] = set()
+        for i, (path, explicit) in enumerate(paths):
+            if path in seen:
+                continue
+            seen.add(path)
+            name = os.path.relpath(path, self.cwd)
+
+            path_key = self._key(path)
+            length = path_key[1] if left is None else min(path_key[1], max(left, 0))
+            digest = self._digests.get((*path_key, length))
+            earlier = self._attached.get(str(path))
+            if dedupe and digest and earlier and earlier[0] == digest:
+                self._refers_to.append(earlier[1])
+                blocks.append(f"`{name}` is unchanged since it was attached earlier.")
+                continue
+
+            if left is not None and left <= 0:
+                skipped = len({p for p, _ in paths[i:]} - seen) + 1
+                logger.warning(f"Attachment limit reached, {skipped} files skipped.")
+                blocks.append(
+                    f"{skipped} more files were not attached, "
+                    f"the limit of {self.max_bytes} bytes was reached."
+                )
+                break
+
+            content, size, binary, digest = self._read(path, left)
+            if binary:
+                if explicit:
+                    blocks.append(f"`{name}` is a binary file and was not attached.")
+                continue
+
+            attached[str(path)] = digest
+            truncated = left is not None and size > left
+            if left is not None:
+                left -= min(size, left)
+            fence = _fence(content)
+            if not content.endswith("\n"):
+                content += "\n"
+            blocks.append(
+                f"`{name}`{' (truncated)' if truncated else ''}:\n"
+                f"{fence}\n{content}{fence}"
+            )
+            if truncated:
+                logger.warning(f"{name} was truncated to fit the attachment limit.")
+        return blocks
+
+    def _key(self, path: Path) -> tuple[str, int, int]:
+        # Files are hashed again only when their size or mtime change
+        try:
+            stat = path.stat()
+        except OSError as e:
+            raise AttachmentError(f"Error reading file: {path}\n{e}")
+        return str(path), stat.st_size, stat.st_mtime_ns
+
+    def _read(self, path: Path, limit: Optional[int]) -> tuple[str, int, bool, str]:
+        # Content up to `limit` bytes, full size, whether the file is
+        # binary and the digest of the content that was read.
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                key = (str(path), stat.st_size, stat.st_mtime_ns)
+                if stat.st_size >= MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        return self._decode(key, data, limit)
+                return self._decode(key, f.read(), limit)
+        except OSError as e:
+            raise AttachmentError(f"Error reading file: {path}\n{e}")
+
+    def _decode(
+        self,
+        key: tuple[str, int, int],
+        data: Union[bytes, mmap.mmap],
+        limit: Optional[int],
+    ) -> tuple[str, int, bool, str]:
+        if _is_binary(data):
+            return "", len(data), True, ""
+        part = data[:limit] if limit is not None else data[:]
+
+        # Only the bytes that are attached are hashed, so the rest of a
+        # large mapped file is never read. Size and mtime stand for it.
+        digest_key = (*key, len(part))
+        if digest_key not in self._digests:
+            digest = hashlib.blake2b(part, digest_size=16)
+            digest.update(f"{key[1]}:{key[2]}".encode())
+            self._digests[digest_key] = digest.hexdigest()
+        return part.decode("utf-8", errors="replace"), len(data), False, self._digests[digest_key]
@@ -0,0 +1,326 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import typer
+from pydantic import BaseModel, Field, ValidationError
+from rich.markup import escape
+
+from llmsh.cli import client, params, utils
+from llmsh.cli.attach import AttachmentError, Attachments, attachment_limit
+from llmsh.cli.error_handler import handle_exceptions, print_error
+from llmsh.cli.renderer import console
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+_overridable = ("model", "max_tokens", "before", "after")
+
+
+class Request(BaseModel):
+    prompt: str
+    model: str
+    max_tokens: Optional[int] = None
+    before: Optional[str] = None
+    after: Optional[str] = None
+    # Line numbers and ids of all input records with this request
+    sources: list[tuple[int, Any]] = Field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        payload = json.dumps(
+            [self.model, self.max_tokens, self.before, self.after, self.prompt],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _errors(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        for error in e.errors()
+    )
+
+
+def read_requests(
+    path: Path,
+    defaults: dict[str, Any],
+) -> Iterator[tuple[int, Any, Optional[Request]]]:
+    # Records that can't be sent are reported and yielded as None, so
+    # that the rest of the batch still runs
+    limit = attachment_limit(settings.attach_bytes, settings.context_tokens)
+    # System prompts of the records with the files they reference, most
+    # records share the same few
+    expanded: dict[Optional[str], Optional[str]] = {}
+
+    def expand(text: Optional[str]) -> Optional[str]:
+        if text not in expanded:
+            # Every record gets all of its files, not only the new ones
+            expanded[text] = Attachments(limit).expand(text)
+        return expanded[text]
+
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                console.print(f"[red]Invalid JSON on line {number} of {path}: {e}[/red]")
+                yield number, None, None
+                continue
+
+            if isinstance(record, str):
+                record = {"prompt": record}
+            if not isinstance(record, dict) or not record.get("prompt"):
+                console.print(f"[red]Line {number} of {path} has no prompt.[/red]")
+                yield number, None, None
+                continue
+
+            # Overrides are read like the command line options, @path
+            # references are replaced by the files
+            options = {k: record.get(k, defaults[k]) for k in _overridable}
+            try:
+                request = Request(prompt=record["prompt"], **options)
+                for name in ("before", "after"):
+                    if name in record:
+                        setattr(request, name, expand(getattr(request, name)))
+            except ValidationError as e:
+                console.print(
+                    f"[red]Line {number} of {path} is invalid: {escape(_errors(e))}[/red]",
+                    highlight=False,
+                )
+                yield number, record.get("id"), None
+                continue
+            except AttachmentError as e:
+                console.print(f"[red]Line {number} of {path}: {escape(str(e))}[/red]", highlight=False)
+                yield number, record.get("id"), None
+                continue
+            yield number, record.get("id"), request
+
+
+def read_checkpoint(path: Path) -> tuple[set[str], Optional[int]]:
+    # Every line is {"key": ..., "offset": ...}, where offset is the size
+    # of the output file right after the results for the key were written.
+    # The first line has no key, only the size of the output before the
+    # run. The offset is None when there is no checkpoint yet.
+    done: set[str] = set()
+    offset: Optional[int] = None
+    if not path.exists():
+        return done, offset
+
+    with open(path, "r+b") as f:
+        valid = 0
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            if "key" in entry:
+                done.add(entry["key"])
+            offset = entry["offset"]
+            valid += len(line)
+
+        # Cut off a partially written last line of an interrupted run
+        f.truncate(valid)
+    return done, offset
+
+
+class ModelLimits:
+    def __init__(self, limits: dict[str, int]) -> None:
+        self._limits = limits
+        self._semaphores: dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str) -> Optional[threading.Semaphore]:
+        if model not in self._limits:
+            return None
+        with self._lock:
+            if model not in self._semaphores:
+                self._semaphores[model] = threading.Semaphore(self._limits[model])
+            return self._semaphores[model]
+
+
+def parse_model_limits(values: Optional[list[str]]) -> dict[str, int]:
+    limits: dict[str, int] = {}
+    for value in values or []:
+        model, _, limit = value.rpartition("=")
+        if not model or not limit.isdigit() or int(limit) < 1:
+            console.print(f"[red]Invalid model limit: {value}. Expected MODEL=N.[/red]")
+            raise typer.Exit(1)
+        limits[model] = int(limit)
+    return limits
+
+
+def send(
+    request: Request,
+    limits: ModelLimits,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+) -> str:
+    semaphore = limits.get(request.model)
+    if semaphore:
+        semaphore.acquire()
+    try:
+        return client.complete_prompt(
+            prompt=request.prompt,
+            model=request.model,
+            before=request.before,
+            after=request.after,
+            max_tokens=request.max_tokens,
+            retries=retries,
+            rate_limit=rate_limit,
+        )
+    finally:
+        if semaphore:
+            semaphore.release()
+
+
+@handle_exceptions
+def batch(
+    input: params.batch_input,
+    output: params.batch_output,
+    model: params.model = settings.model,
+    before: params.before = settings.before,
+    after: params.after = settings.after,
+    max_tokens: params.tokens = settings.max_tokens,
+    retries: params.retries = settings.retries,
+    rate_limit: params.rate_limit = settings.rate_limit,
+    workers: params.workers = settings.workers,
+    model_limit: params.model_limit = None,
+    checkpoint: params.checkpoint = None,
+    debug: params.debug = settings.debug,
+):
+    if debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    utils.check_file_exists(input)
+    checkpoint = checkpoint or output.with_name(output.name + ".checkpoint")
+    limits = ModelLimits(parse_model_limits(model_limit))
+
+    logger.debug(f"input: {input}")
+    logger.debug(f"output: {output}")
+    logger.debug(f"checkpoint: {checkpoint}")
+    logger.debug(f"workers: {workers}")
+    logger.debug(f"model_limit: {model_limit}")
+    logger.debug(f"retries: {retries}")
+    logger.debug(f"rate_limit: {rate_limit}")
+
+    if text_from_file := utils.read_if_path(before):
+        before = text_from_file
+    if text_from_file := utils.read_if_path(after):
+        after = text_from_file
+
+    # Group identical records, so that each request is sent only once
+    defaults = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "before": before,
+        "after": after,
+    }
+    requests: dict[str, Request] = {}
+    invalid = 0
+    for number, record_id, request in read_requests(input, defaults):
+        if request is None:
+            invalid += 1
+            continue
+        request = requests.setdefault(request.key, request)
+        request.sources.append((number, record_id))
+
+    # Drop anything written after the last checkpoint and skip finished keys.
+    # Without a checkpoint the results are appended to what is there.
+    done, offset = read_checkpoint(checkpoint)
+    if offset is not None and output.exists():
+        with open(output, "r+b") as f:
+            f.truncate(offset)
+    pending = [r for k, r in requests.items() if k not in done]
+    logger.debug(
+        f"{len(requests)} unique requests, {len(requests) - len(pending)} already done."
+    )
+
+    sent = failed = 0
+    workers = max(workers, 1)
+    with open(output, "ab") as out, open(checkpoint, "ab") as checkpoint_file, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        if offset is None:
+            entry = {"offset": out.seek(0, os.SEEK_END)}
+            checkpoint_file.write(json.dumps(entry).encode("utf-8") + b"\n")
+            checkpoint_file.flush()
+
+        queue = iter(pending)
+        in_flight: dict[Future, Request] = {}
+
+        def submit() -> None:
+            for request in queue:
+                future = executor.submit(
+                    send, request, limits, retries, rate_limit
+                )
+                in_flight[future] = request
+                if len(in_flight) >= workers * 2:
+                    break
+
+        try:
+            submit()
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    request = in_flight.pop(future)
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        failed += 1
+                        console.print(f"[red]Request from line {request.sources[0][0]} failed.[/red]")
+                        print_error(e)
+                        continue
+
+                    # Results first, then the checkpoint that covers them
+                    for number, record_id in request.sources:
+                        row = {
+                            "id": record_id,
+                            "line": number,
+                            "model": request.model,
+                            "content": content,
+                        }
+                        out.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+                    out.flush()
+                    entry = {"key": request.key, "offset": out.tell()}
+                    checkpoint_file.write(json.dumps(entry).encode("utf-8") + b"\n")
+                    checkpoint_file.flush()
+                    sent += 1
+                submit()
+
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+
+    console.print(
+        f"Sent {sent}, skipped {len(requests) - len(pending)} already done "
+        f"and {invalid} invalid records, failed {failed}, "
+        f"{len(requests)} unique requests in total."
+    )
+    if failed or invalid:
+        raise typer.Exit(1)
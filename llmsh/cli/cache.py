@@ -0,0 +1,131 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+# Evict expired and least recently used entries every so many writes
+_evict_every = 32
+
+
+def cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "llmsh"
+
+
+def request_key(context: list[dict], **params: Any) -> str:
+    # Stable hash of everything that affects the response
+    payload = json.dumps(
+        {"messages": context, **params},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Responses stored in SQLite, shared by concurrent `llmsh` processes.
+
+    Entries older than `ttl` seconds are never returned. Once the total
+    size goes over `max_bytes`, least recently used entries are evicted.
+    """
+
+    def __init__(self, path: Path, ttl: float, max_bytes: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_schema)
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        row = self._db.execute(
+            "SELECT content FROM responses WHERE key = ? AND created >= ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            logger.debug(f"Cache miss: {key}")
+            return None
+
+        logger.debug(f"Cache hit: {key}")
+        self._db.execute(
+            "UPDATE responses SET accessed = ? WHERE key = ?",
+            (now, key),
+        )
+        return row[0]
+
+    def set(self, key: str, content: str) -> None:
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, content, len(content.encode("utf-8")), now, now),
+        )
+        self._writes += 1
+        if self._writes % _evict_every == 1:
+            self.evict()
+
+    def evict(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            expired = self._db.execute(
+                "DELETE FROM responses WHERE created < ?",
+                (time.time() - self.ttl,),
+            ).rowcount
+            oversized = self._db.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (
+                            ORDER BY accessed DESC, key
+                        ) AS total
+                        FROM responses
+                    ) WHERE total > ?
+                )
+                """,
+                (self.max_bytes,),
+            ).rowcount
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        logger.debug(f"Cache evicted {expired} expired and {oversized} least recently used entries.")
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,217 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import logging
+import os
+from typing import Any, Optional
+
+from llmsh.cli import utils
+from llmsh.cli.retry import call_with_retry, call_with_retry_async
+from llmsh.models.message import Message
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Idle connections of the shared HTTP client are kept open this long
+_keepalive_seconds = 300.0
+
+# Providers that cache a prompt prefix only up to explicit cache_control
+# marks. Others, like OpenAI, cache automatically and may reject the marks.
+_cache_mark_providers = ("anthropic", "bedrock", "vertex_ai", "vertex_ai_beta", "gemini")
+
+
+def supports_cache_marks(model: str) -> bool:
+    litellm = utils.import_litellm()
+    try:
+        provider = litellm.get_llm_provider(model)[1]
+    except Exception:
+        return False
+    return provider in _cache_mark_providers
+
+
+def _stream_options(litellm: Any, model: str, stream: bool, include_usage: bool) -> dict:
+    if stream and include_usage:
+        # Token usage is sent in the last chunk where supported
+        supported = litellm.get_supported_openai_params(model=model) or []
+        if "stream_options" in supported:
+            return {"stream_options": {"include_usage": True}}
+    return {}
+
+
+def completion(
+    model: str,
+    messages: list[dict],
+    stream: bool = False,
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+    include_usage: bool = False,
+) -> Any:
+    litellm = utils.import_litellm()
+    extra = _stream_options(litellm, model, stream, include_usage)
+    return call_with_retry(
+        lambda: litellm.completion(
+            model=model,
+            messages=messages,
+            stream=stream,
+            max_tokens=max_tokens,
+            # Retries are handled by call_with_retry
+            max_retries=0,
+            **extra,
+        ),
+        model=model,
+        retries=retries,
+        rate_limit=rate_limit,
+    )
+
+
+async def acompletion(
+    model: str,
+    messages: list[dict],
+    stream: bool = False,
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+    include_usage: bool = False,
+) -> Any:
+    litellm = utils.import_litellm()
+    extra = _stream_options(litellm, model, stream, include_usage)
+    return await call_with_retry_async(
+        lambda: litellm.acompletion(
+            model=model,
+            messages=messages,
+            stream=stream,
+            max_tokens=max_tokens,
+            max_retries=0,
+            **extra,
+        ),
+        model=model,
+        retries=retries,
+        rate_limit=rate_limit,
+    )
+
+
+def close_stream(response: Any) -> None:
+    # Closing the underlying stream releases the HTTP connection
+    for target in (getattr(response, "completion_stream", None), response):
+        close = getattr(target, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+            return
+
+
+async def aclose_stream(response: Any) -> None:
+    # Streams of acompletion are closed asynchronously, others as usual
+    aclose = getattr(response, "aclose", None)
+    if callable(aclose):
+        try:
+            await aclose()
+        except Exception:
+            pass
+        return
+    close_stream(response)
+
+
+def _connection_base(litellm: Any, model: str) -> Optional[str]:
+    # Base URL of the providers that are called through the OpenAI client,
+    # which sends requests over `litellm.aclient_session` when it is set.
+    _, provider, _, api_base = litellm.get_llm_provider(model)
+    if provider == "openai":
+        return (
+            api_base
+            or litellm.api_base
+            or os.environ.get("OPENAI_BASE_URL")
+            or os.environ.get("OPENAI_API_BASE")
+            or "https://api.openai.com/v1"
+        )
+    if provider in litellm.openai_compatible_providers:
+        return api_base
+    return None
+
+
+def load_provider(model: str) -> Any:
+    # Import litellm and what the first request to the model would import
+    litellm = utils.import_litellm()
+    try:
+        if _connection_base(litellm, model):
+            # The OpenAI client imports its resources on the first request
+            importlib.import_module("openai.resources.chat")
+    except Exception as e:
+        logger.debug(f"Failed to import the client for {model}: {e}")
+    return litellm
+
+
+async def warm(model: str) -> None:
+    """Do the work that precedes the first request to the model.
+
+    Imports litellm and resolves the provider. For OpenAI-compatible
+    providers it also imports the OpenAI client and opens a connection in
+    a shared HTTP client, which keeps it alive between requests. Failures are only logged, the
+    request itself will report them.
+    """
+    import asyncio
+
+    try:
+        litellm = await asyncio.to_thread(load_provider, model)
+        base = _connection_base(litellm, model)
+        if not base:
+            return
+
+        if litellm.aclient_session is None:
+            import httpx
+
+            # Same verification settings litellm applies to its own clients
+            verify = os.environ.get("SSL_VERIFY", litellm.ssl_verify)
+            if isinstance(verify, str) and verify.lower() in ("false", "0"):
+                verify = False
+            litellm.aclient_session = httpx.AsyncClient(
+                verify=verify,
+                limits=httpx.Limits(keepalive_expiry=_keepalive_seconds),
+                follow_redirects=True,
+            )
+        # Any response will do, the point is the handshake
+        await litellm.aclient_session.head(base, timeout=10)
+        logger.debug(f"Connection to {base} is warm.")
+    except Exception as e:
+        logger.debug(f"Failed to warm up the connection for {model}: {e}")
+
+
+def complete_prompt(
+    prompt: str,
+    model: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+) -> str:
+    # Single turn request without any history
+    context = utils.prepare_context(
+        messages=[Message(role=settings.user_role, content=prompt)],
+        before=before,
+        after=after,
+    )
+    response = completion(
+        model=model,
+        messages=context,
+        max_tokens=max_tokens,
+        retries=retries,
+        rate_limit=rate_limit,
+    )
+    return response.choices[0].message.content or ""
@@ -0,0 +1,125 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+from typing import Callable, Optional
+
+from llmsh.cli import client
+from llmsh.models.message import Message
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+INSTRUCTIONS = (
+    "Summarize the conversation below so that it can continue without it. "
+    "Keep every fact, decision, name, number and piece of code that may be "
+    "referred to later. Drop greetings and repetitions. Reply with the "
+    "summary only."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n\n"
+
+
+class Compactor:
+    """Summarizes older chat turns in a background thread.
+
+    `start` is called after a turn, while the user is typing the next
+    prompt. Once the summary is ready, `current` returns it together with
+    the number of leading messages it replaces. Requests never wait for
+    it, until then the full history is sent.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        threshold: int,
+        count_tokens: Callable[[Message], int],
+        retries: int = 0,
+        rate_limit: Optional[float] = None,
+    ) -> None:
+        self.model = model
+        self.threshold = threshold
+        self.count_tokens = count_tokens
+        self.retries = retries
+        self.rate_limit = rate_limit
+
+        self._summary: Optional[Message] = None
+        self._covers = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def current(self) -> tuple[Optional[Message], int]:
+        with self._lock:
+            return self._summary, self._covers
+
+    def start(self, messages: list[Message]) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+
+        summary, covers = self.current()
+        history = messages[covers:]
+        used = sum(self.count_tokens(m) for m in history)
+        if summary:
+            used += self.count_tokens(summary)
+        if used <= self.threshold:
+            return
+
+        # Recent messages that fit into half of the threshold are kept
+        kept, end = 0, len(messages)
+        while end > covers:
+            kept += self.count_tokens(messages[end - 1])
+            if kept > self.threshold // 2:
+                break
+            end -= 1
+
+        # The last exchange is always kept, starting with the question
+        end = min(end, len(messages) - 1)
+        while end > covers and messages[end].role != settings.user_role:
+            end -= 1
+        if end - covers < 2:
+            return
+
+        logger.debug(f"Compacting messages {covers}-{end} with {self.model}.")
+        self._thread = threading.Thread(
+            target=self._compact,
+            args=(summary, messages[covers:end], end),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _compact(self, summary: Optional[Message], turns: list[Message], end: int) -> None:
+        parts = [summary.content] if summary else []
+        parts += [f"{m.role}: {m.content}" for m in turns]
+        try:
+            content = client.complete_prompt(
+                prompt="\n\n".join(parts),
+                model=self.model,
+                before=INSTRUCTIONS,
+                retries=self.retries,
+                rate_limit=self.rate_limit,
+            )
+        except Exception as e:
+            # The full history is sent until a later attempt succeeds
+            logger.warning(f"Failed to compact the conversation: {e}")
+            return
+
+        with self._lock:
+            self._summary = Message(
+                role=settings.system_role,
+                content=SUMMARY_PREFIX + content,
+                model=self.model,
+            )
+            self._covers = end
+        logger.debug(f"Compacted {len(turns)} messages.")
@@ -0,0 +1,257 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+import click
+import typer
+from click.core import ParameterSource
+
+from llmsh.cli import client, params, pipeline, utils
+from llmsh.cli.attach import AttachmentError, Attachments, attachment_limit
+from llmsh.cli.error_handler import error_message, handle_exceptions
+from llmsh.cli.renderer import console
+from llmsh.cli.retry import call_with_retry_async
+from llmsh.cli.thin import owned_socket, provider_env, socket_path
+from llmsh.models.message import Message
+from llmsh.settings import Settings, settings
+
+
+logger = logging.getLogger(__name__)
+
+# Options the daemon doesn't handle, such requests run in the client
+_local_only = (
+    "interactive",
+    "resume",
+    "each_line",
+    "each_record",
+    "map_reduce",
+    "cache",
+    "semantic_cache",
+    "fallback",
+    "compare",
+    "debug",
+    "stats",
+    "metrics_file",
+    "output",
+)
+
+
+@lru_cache(maxsize=None)
+def _command() -> tuple[click.Command, tuple[str, ...]]:
+    from llmsh.cli.app import _subcommands, loop, make_app
+
+    return typer.main.get_command(make_app("default", loop)), tuple(_subcommands)
+
+
+def parse_request(request: dict) -> Optional[dict[str, Any]]:
+    # Options of the request, or None if it has to run in the client
+    args = list(request.get("argv", []))
+    command, subcommands = _command()
+    if args and args[0] in subcommands or "-h" in args or "--help" in args:
+        return None
+
+    # Requests are sent with the daemon's own keys and endpoints
+    if request.get("provider") != provider_env(os.environ):
+        logger.debug("Provider variables of the client differ from the daemon's.")
+        return None
+
+    try:
+        ctx = command.make_context("llmsh", args)
+    except (click.ClickException, click.exceptions.Exit):
+        return None
+
+    # Defaults come from the client's LLMSH_* environment variables.
+    # Some of them, like LLMSH_DAEMON, are only read by the client.
+    overrides = {
+        name: v
+        for k, v in request.get("env", {}).items()
+        if (name := k[len("LLMSH_"):].lower()) in Settings.model_fields
+    }
+    try:
+        client_settings = Settings(**overrides)
+    except Exception as e:
+        logger.debug(f"Invalid settings in the client's environment: {e}")
+        return None
+
+    options: dict[str, Any] = {}
+    for name, value in ctx.params.items():
+        # Compared by name, the enum may come from typer's copy of click
+        if ctx.get_parameter_source(name).name == ParameterSource.DEFAULT.name:
+            value = getattr(client_settings, name, value)
+        options[name] = value
+    if any(options.get(name) for name in _local_only):
+        return None
+    if options.get("output_format", "text") != "text":
+        return None
+
+    # Referenced files are read relative to the client's directory
+    attachments = Attachments(
+        attachment_limit(options["attach_bytes"], options["context_tokens"]),
+        cwd=Path(request.get("cwd", ".")),
+    )
+    try:
+        for name in ("prompt", "before", "after"):
+            options[name] = attachments.expand(options[name])
+    except AttachmentError:
+        return None
+    return options
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict) -> None:
+    writer.write(json.dumps(message).encode("utf-8") + b"\n")
+    await writer.drain()
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    response: Any = None
+    try:
+        request = json.loads(await reader.readline() or b"null")
+        options = parse_request(request) if request else None
+        if options is None:
+            logger.debug("Request runs in the client.")
+            await _send(writer, {"accept": False})
+            return
+
+        raw = options["raw"] or not request.get("tty")
+        await _send(writer, {
+            "accept": True,
+            "raw": raw,
+            "flush_bytes": options["flush_bytes"],
+        })
+
+        prompt = options["prompt"] or ""
+        if request.get("pipe"):
+            header = json.loads(await reader.readline())
+            data = await reader.readexactly(header["stdin"])
+            text = data.decode("utf-8", errors="replace").rstrip("\r\n")
+            prompt = pipeline.join_prompt(prompt, text)
+        if not prompt:
+            await _send(writer, {
+                "error": "[red]Non-interactive mode requires a prompt.[/red]",
+                "exit": 1,
+            })
+            return
+
+        model = options["model"]
+        context = utils.prepare_context(
+            messages=[Message(role=settings.user_role, content=prompt)],
+            before=options["before"],
+            after=options["after"],
+            # Same as in the client, for providers that need the marks
+            cache_marks=options["prompt_cache"] and client.supports_cache_marks(model),
+        )
+        litellm = utils.import_litellm()
+        stream = not options["no_stream"]
+        logger.debug(f"Request to {model}, stream: {stream}")
+
+        try:
+            response = await call_with_retry_async(
+                lambda: litellm.acompletion(
+                    model=model,
+                    messages=context,
+                    stream=stream,
+                    max_tokens=options["max_tokens"],
+                    max_retries=0,
+                ),
+                model=model,
+                retries=options["retries"],
+                rate_limit=options["rate_limit"],
+            )
+            if stream:
+                async for chunk in response:
+                    if content := chunk.choices[0].delta.content:
+                        await _send(writer, {"delta": content})
+            else:
+                content = response.choices[0].message.content or ""
+                await _send(writer, {"delta": content})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            await _send(writer, {"error": error_message(e), "exit": 1})
+            return
+
+        await _send(writer, {"exit": 0})
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        # The client has gone away, stop generating the answer
+        logger.debug("Client disconnected.")
+        if response is not None and hasattr(response, "aclose"):
+            try:
+                await response.aclose()
+            except Exception:
+                pass
+
+    finally:
+        writer.close()
+
+
+async def serve(path: str) -> None:
+    server = await asyncio.start_unix_server(handle, path=path)
+    os.chmod(path, 0o600)
+    console.print(f"[blue]Listening on {path}[/blue]", highlight=False)
+
+    # Stop gracefully on `kill`, so that the socket gets removed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+
+def is_running(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+@handle_exceptions
+def daemon(
+    debug: params.debug = settings.debug,
+):
+    if debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    path = socket_path()
+    if os.path.lexists(path):
+        if not owned_socket(path):
+            console.print(f"[red]{path} belongs to another user or is not a socket[/red]")
+            raise typer.Exit(1)
+        if is_running(path):
+            console.print(f"[red]Daemon is already running on {path}[/red]")
+            raise typer.Exit(1)
+        os.unlink(path)
+
+    # Pay for the imports once, up front
+    utils.import_litellm()
+
+    try:
+        asyncio.run(serve(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,210 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from llmsh.cli import client, utils
+from llmsh.models.message import Message
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Put into the queue by the reader once the stream has ended
+_done = object()
+
+
+class Engine:
+    """Event loop that requests and streams responses for a whole session.
+
+    The loop runs in its own thread and outlives single requests, so that
+    the async HTTP clients of litellm, which are bound to it, are reused
+    between chat turns, and connections can be prepared in the background
+    while the main thread waits for input.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="llmsh-engine", daemon=True
+        )
+        self._thread.start()
+        self._warming: Optional[Future] = None
+
+    def run(self, awaitable: Awaitable[T]) -> T:
+        result: Future = Future()
+        finished = threading.Event()
+        tasks: list[asyncio.Task] = []
+
+        def done(task: asyncio.Task) -> None:
+            if task.cancelled():
+                result.cancel()
+            elif (e := task.exception()) is not None:
+                result.set_exception(e)
+            else:
+                result.set_result(task.result())
+            finished.set()
+
+        def start() -> None:
+            tasks.append(self._loop.create_task(awaitable))
+            tasks[0].add_done_callback(done)
+
+        self._loop.call_soon_threadsafe(start)
+        try:
+            return result.result()
+        except KeyboardInterrupt:
+            # Ctrl+C cancels the task and lets it clean up before re-raising
+            self._loop.call_soon_threadsafe(lambda: tasks[0].cancel())
+            finished.wait()
+            raise
+
+    def warm(self, models: list[str]) -> None:
+        # Runs in the background, nobody waits for it
+        if self._warming is None or self._warming.done():
+            self._warming = asyncio.run_coroutine_threadsafe(
+                _warm(models), self._loop
+            )
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(_shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+async def _warm(models: list[str]) -> None:
+    await asyncio.gather(*(client.warm(m) for m in models))
+
+
+async def _shutdown() -> None:
+    # Like asyncio.run, cancel what is left, e.g. a warm-up on a quick exit
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.get_running_loop().shutdown_asyncgens()
+
+
+async def iterate_in_thread(iterator: Iterator[T]) -> AsyncIterator[T]:
+    # Blocking iterators, e.g. hedged streams, are read in a worker thread.
+    # It is the only thread, so closing waits for a read in progress.
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    end = object()
+    try:
+        while (item := await loop.run_in_executor(executor, next, iterator, end)) is not end:
+            yield item
+    finally:
+        if callable(close := getattr(iterator, "close", None)):
+            executor.submit(close)
+        executor.shutdown(wait=False)
+
+
+async def pump(chunks: AsyncIterable[Any], feed: Callable[[str], None]) -> None:
+    """Read the stream and render it in two tasks connected by a queue.
+
+    The reader never waits for the terminal. The renderer takes whatever
+    has arrived since its last turn and feeds it in one call, in a worker
+    thread, so a slow redraw delays the next redraw and not the network.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def read() -> None:
+        try:
+            async for chunk in chunks:
+                if chunk.choices and (content := chunk.choices[0].delta.content):
+                    queue.put_nowait(content)
+        finally:
+            queue.put_nowait(_done)
+
+    reader = asyncio.create_task(read())
+    rendering: Optional[asyncio.Future] = None
+    try:
+        finished = False
+        while not finished:
+            parts = [await queue.get()]
+            while not queue.empty():
+                parts.append(queue.get_nowait())
+            if parts[-1] is _done:
+                parts.pop()
+                finished = True
+            if parts:
+                rendering = asyncio.ensure_future(asyncio.to_thread(feed, "".join(parts)))
+                await rendering
+        # Errors of the stream are raised here
+        await reader
+
+    finally:
+        reader.cancel()
+        # The renderer must be idle before the caller touches the output
+        pending = {reader} | ({rendering} if rendering else set())
+        await asyncio.wait(pending)
+
+
+async def stream(
+    prompt: str,
+    model: Optional[str] = None,
+    history: Sequence[Message] = (),
+    before: Optional[str] = settings.before,
+    after: Optional[str] = settings.after,
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """Stream the answer to a prompt, text delta by text delta.
+
+    This is the engine of the CLI without the CLI around it:
+
+        async for delta in llmsh.stream("Explain monads", model="gpt-4o-mini"):
+            print(delta, end="", flush=True)
+
+    `history` holds earlier messages of the conversation. Breaking out of
+    the loop closes the stream on the provider side.
+    """
+    model = model or settings.model
+    context = utils.prepare_context(
+        messages=[*history, Message(role=settings.user_role, content=prompt)],
+        before=before,
+        after=after,
+    )
+    response = await client.acompletion(
+        model=model,
+        messages=context,
+        stream=True,
+        max_tokens=max_tokens,
+        retries=retries,
+        rate_limit=rate_limit,
+    )
+    try:
+        async for chunk in response:
+            if chunk.choices and (content := chunk.choices[0].delta.content):
+                yield content
+    finally:
+        await client.aclose_stream(response)
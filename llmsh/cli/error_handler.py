@@ -12,27 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from functools import wraps
+import sys
+from functools import lru_cache, wraps
 from typing import Any
 
 import typer
-from litellm.exceptions import (
-    AuthenticationError,
-    NotFoundError,
-    BadRequestError,
-    UnprocessableEntityError,
-    Timeout,
-    PermissionDeniedError,
-    RateLimitError,
-    ContextWindowExceededError,
-    ContentPolicyViolationError,
-    ServiceUnavailableError,
-    APIError,
-    APIConnectionError,
-    APIResponseValidationError,
-    OpenAIError,
-    BudgetExceededError,
-)
 
 from llmsh.cli.renderer import console
 
@@ -62,62 +46,65 @@ _openai_error = """[red]OpenAI error.[/red]"""
 _budget_exceeded_error = """[red]Budget exceeded.[/red]"""
 
 
-def handle_exceptions(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        has_error_occurred = True
-        result: Any = None
-        try:
-            result = f(*args, **kwargs)
-            has_error_occurred = False
-        except AuthenticationError as ae:
-            console.print(_authentication_error)
-            
-        except NotFoundError as nfe:
-            console.print(_not_found_error)
-
-        except BadRequestError as bre:
-            console.print(_bad_request_error)
-            console.print(f"{bre}")
-
-        except UnprocessableEntityError as uee:
-            console.print(_unprocessable_entity_error)
-        
-        except Timeout as t:
-            console.print(_timeout_error)
+_error_messages = [
+    ("AuthenticationError", _authentication_error, False),
+    ("NotFoundError", _not_found_error, False),
+    ("BadRequestError", _bad_request_error, True),
+    ("UnprocessableEntityError", _unprocessable_entity_error, False),
+    ("Timeout", _timeout_error, False),
+    ("PermissionDeniedError", _permission_denied_error, False),
+    ("RateLimitError", _rate_limit_error, False),
+    ("ContextWindowExceededError", _context_window_exceeded_error, False),
+    ("ContentPolicyViolationError", _content_policy_violation_error, False),
+    ("ServiceUnavailableError", _service_unavailable_error, False),
+    ("APIError", _api_error, False),
+    ("APIConnectionError", _api_connection_error, False),
+    ("APIResponseValidationError", _api_response_validation_error, False),
+    ("OpenAIError", _openai_error, False),
+    ("BudgetExceededError", _budget_exceeded_error, False),
+]
 
-        except PermissionDeniedError as pde:
-            console.print(_permission_denied_error)
 
-        except RateLimitError as rle:
-            console.print(_rate_limit_error)
+@lru_cache(maxsize=None)
+def _resolve_error_classes() -> tuple:
+    # Exception classes are looked up only after an error has actually
+    # occurred, so that importing this module does not import litellm.
+    from litellm import exceptions
 
-        except ContextWindowExceededError as cwee:
-            console.print(_context_window_exceeded_error)
+    resolved = []
+    for name, message, show_details in _error_messages:
+        cls = getattr(exceptions, name, None)
+        if cls is not None:
+            resolved.append((cls, message, show_details))
+    return tuple(resolved)
 
-        except ContentPolicyViolationError as cpve:
-            console.print(_content_policy_violation_error)
 
-        except ServiceUnavailableError as sue:
-            console.print(_service_unavailable_error)
+def error_message(e: Exception) -> str:
+    # If litellm was never imported, the error can't originate from it.
+    if "litellm" in sys.modules:
+        for cls, message, show_details in _resolve_error_classes():
+            if isinstance(e, cls):
+                return f"{message}\n{e}" if show_details else message
 
-        except APIError as ae:
-            console.print(_api_error)
+    return f"[red]{e}[/red]"
 
-        except APIConnectionError as ace:
-            console.print(_api_connection_error)
 
-        except APIResponseValidationError as arve:
-            console.print(_api_response_validation_error)
+def print_error(e: Exception) -> None:
+    console.print(error_message(e))
 
-        except OpenAIError as oae:
-            console.print(_openai_error)
-
-        except BudgetExceededError as bee:
-            console.print(_budget_exceeded_error)
 
+def handle_exceptions(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        has_error_occurred = True
+        result: Any = None
+        try:
+            result = f(*args, **kwargs)
+            has_error_occurred = False
+        except typer.Exit:
+            raise
         except Exception as e:
-            console.print(f"[red]{e}[/red]")
+            print_error(e)
 
         if has_error_occurred:
             raise typer.Exit(1)
@@ -0,0 +1,106 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from typing import Any, AsyncIterator, BinaryIO, Iterable, Optional
+
+
+class EventWriter:
+    """JSON lines written to a binary file.
+
+    The file is flushed after every `flush_bytes` bytes, or only at the
+    end of every response when `flush_bytes` is None.
+    """
+
+    def __init__(self, file: BinaryIO, flush_bytes: Optional[int] = None) -> None:
+        self.flush_bytes = flush_bytes
+
+        self._file = file
+        self._pending = 0
+
+    def write(self, event: dict) -> None:
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        self._pending += self._file.write(line.encode("utf-8"))
+        if self.flush_bytes is not None and self._pending >= self.flush_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+
+
+def _usage(usage: Any) -> Optional[dict]:
+    if not usage:
+        return None
+    return {
+        name: getattr(usage, name, None)
+        for name in ("prompt_tokens", "completion_tokens", "total_tokens")
+    }
+
+
+class ResponseEvents:
+    """Events of a single response, as it arrives.
+
+    A `delta` event for every piece of content, with `t` the seconds
+    since the request started, then an `end` event with the whole text,
+    the model, token usage and the finish reason.
+    """
+
+    def __init__(self, writers: Iterable[EventWriter], model: str) -> None:
+        self.model = model
+        self.cached = False
+        self.usage: Optional[dict] = None
+        self.finish_reason: Optional[str] = None
+
+        self._writers = list(writers)
+        self._started = time.monotonic()
+
+    def delta(self, content: str) -> None:
+        self._write("delta", content=content)
+
+    async def atrack(self, response: Any) -> AsyncIterator[Any]:
+        # Deltas are written as they are read, before they are rendered
+        async for chunk in response:
+            self.chunk(chunk)
+            yield chunk
+
+    def chunk(self, chunk: Any) -> None:
+        if chunk.choices:
+            choice = chunk.choices[0]
+            # Streamed chunks have a delta, whole responses a message
+            message = getattr(choice, "delta", None) or getattr(choice, "message", None)
+            if message and message.content:
+                self.delta(message.content)
+            self.finish_reason = choice.finish_reason or self.finish_reason
+        self.usage = _usage(getattr(chunk, "usage", None)) or self.usage
+
+    def end(self, text: str, truncated: bool = False) -> None:
+        self._write(
+            "end",
+            text=text,
+            model=self.model,
+            cached=self.cached,
+            truncated=truncated,
+            usage=self.usage,
+            finish_reason=self.finish_reason,
+        )
+        for writer in self._writers:
+            writer.flush()
+
+    def _write(self, kind: str, **fields: Any) -> None:
+        t = round(time.monotonic() - self._started, 6)
+        event = {"type": kind, "t": t, **fields}
+        for writer in self._writers:
+            writer.write(event)
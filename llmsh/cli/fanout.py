@@ -0,0 +1,190 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from rich.console import Console
+
+from llmsh.cli import client
+from llmsh.cli.error_handler import error_message
+from llmsh.cli.stats import RequestStats
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_models(models_list: str) -> list[str]:
+    models: list[str] = []
+    for name in models_list.split(","):
+        if (name := name.strip()) and name not in models:
+            models.append(name)
+    return models
+
+
+class Answer:
+    """Response of one of the compared models, filled by its own thread."""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.stats = RequestStats(model)
+        self.error: Optional[str] = None
+        self.done = False
+        self.interrupted = False
+        self.response: Any = None
+        self._parts: list[str] = []
+        self._started = time.perf_counter()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def run(
+        self,
+        context: list[dict],
+        max_tokens: Optional[int],
+        retries: int,
+        rate_limit: Optional[float],
+    ) -> None:
+        self.stats.start()
+        self.stats.prepared()
+        try:
+            self.response = client.completion(
+                model=self.model,
+                messages=context,
+                stream=True,
+                max_tokens=max_tokens,
+                retries=retries,
+                rate_limit=rate_limit,
+                include_usage=True,
+            )
+            self.stats.sent()
+            for chunk in self.stats.track(self.response):
+                if chunk.choices and (content := chunk.choices[0].delta.content):
+                    self._parts.append(content)
+        except Exception as e:
+            if self.interrupted:
+                return
+            # A failing model doesn't affect the others
+            logger.debug(f"{self.model} failed: {type(e).__name__}: {e}")
+            self.error = error_message(e)
+        finally:
+            self.stats.finish()
+            self.done = True
+
+    def status(self) -> str:
+        if self.interrupted:
+            return "[yellow]interrupted[/yellow]"
+        if self.error:
+            return "[red]failed[/red]"
+        if not self.done:
+            return f"{time.perf_counter() - self._started:.1f}s"
+        s = self.stats.summary()
+        first = "-" if s["ttft_s"] is None else f"{s['ttft_s']:.2f}s"
+        return f"first token {first}, {s['tokens']} tokens, {s['total_s']:.1f}s"
+
+
+def _render(answers: list[Answer], width: int) -> Any:
+    from rich.columns import Columns
+    from rich.console import Group
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+
+    panels = []
+    for answer in answers:
+        body: Any = Markdown(answer.text)
+        if answer.error:
+            body = Group(body, answer.error) if answer.text else answer.error
+        panels.append(
+            Panel(body, title=answer.model, subtitle=answer.status(), width=width)
+        )
+    return Columns(panels)
+
+
+def fan_out(
+    console: Console,
+    models: list[str],
+    context: list[dict],
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+    raw: bool = False,
+    stats: bool = False,
+    metrics_file: Optional[Path] = None,
+    refresh_per_second: float = 10,
+) -> bool:
+    """Send the same context to every model at once.
+
+    In a terminal the answers stream side by side, one panel per model,
+    otherwise they are printed one after another once all are done.
+    Returns False if any of the models has failed.
+    """
+    answers = [Answer(model) for model in models]
+    threads = [
+        threading.Thread(
+            target=answer.run,
+            args=(context, max_tokens, retries, rate_limit),
+            daemon=True,
+        )
+        for answer in answers
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Up to three panels side by side, more are wrapped
+    width = max(console.width // min(len(answers), 3) - 1, 20)
+    try:
+        if raw:
+            for thread in threads:
+                thread.join()
+        else:
+            from rich.live import Live
+
+            with Live(
+                _render(answers, width),
+                console=console,
+                auto_refresh=False,
+                transient=True,
+                vertical_overflow="crop",
+            ) as live:
+                while any(thread.is_alive() for thread in threads):
+                    time.sleep(1 / refresh_per_second)
+                    live.update(_render(answers, width), refresh=True)
+    except KeyboardInterrupt:
+        # Stop every model, keep what has arrived
+        for answer in answers:
+            if not answer.done:
+                answer.interrupted = True
+                client.close_stream(answer.response)
+        for thread in threads:
+            thread.join(timeout=1)
+
+    if raw:
+        # Same headers as `head` uses for several files
+        for answer in answers:
+            sys.stdout.write(f"==> {answer.model} <==\n{answer.text}\n\n")
+            sys.stdout.flush()
+            if answer.error:
+                Console(stderr=True).print(f"{answer.model}: {answer.error}")
+    else:
+        console.print(_render(answers, width))
+
+    if stats or metrics_file:
+        for answer in answers:
+            answer.stats.report(metrics_file, show=stats)
+    return not any(answer.error or answer.interrupted for answer in answers)
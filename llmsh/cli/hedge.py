@@ -0,0 +1,174 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+from llmsh.cli.client import close_stream
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_models(model: str, fallback: Optional[str]) -> list[str]:
+    models = [model]
+    for name in (fallback or "").split(","):
+        if (name := name.strip()) and name not in models:
+            models.append(name)
+    return models
+
+
+def prefer(models: list[str], model: str) -> list[str]:
+    # Put the model that answered last in front of the others
+    return [model] + [m for m in models if m != model]
+
+
+def first_content(response: Any) -> tuple[list[Any], Iterator[Any]]:
+    # Read the stream until a chunk with actual content arrives
+    iterator = iter(response)
+    buffered = []
+    for chunk in iterator:
+        buffered.append(chunk)
+        if chunk.choices and chunk.choices[0].delta.content:
+            break
+    return buffered, iterator
+
+
+def _chain(buffered: list[Any], rest: Iterator[Any], response: Any) -> Iterator[Any]:
+    # Closing the iterator closes the winner's stream
+    try:
+        yield from buffered
+        yield from rest
+    finally:
+        close_stream(response)
+
+
+class _Lost(Exception):
+    pass
+
+
+def race(
+    models: list[str],
+    request: Callable[[str], Any],
+    stream: bool,
+    hedge_after: Optional[float] = None,
+) -> tuple[str, Any]:
+    """Send the request to the models in order until one of them answers.
+
+    The next model is tried when the previous one fails or, with
+    `hedge_after`, when it hasn't produced its first token in time. The
+    first model to produce content wins and the other streams are closed.
+    For streams the winner's response is returned as an iterator over all
+    of its chunks.
+    """
+    results: queue.Queue = queue.Queue()
+    done = threading.Event()
+    lock = threading.Lock()
+    # Streams that are still waiting for their first token
+    waiting: dict[str, Any] = {}
+
+    def close_waiting() -> None:
+        # Called once there is a winner, so losers stop generating now
+        with lock:
+            losers = list(waiting.items())
+            waiting.clear()
+        for model, response in losers:
+            logger.debug(f"Closing the losing response from {model}.")
+            close_stream(response)
+
+    def attempt(model: str) -> None:
+        response = None
+        try:
+            response = request(model)
+            if stream:
+                with lock:
+                    if not done.is_set():
+                        waiting[model] = response
+                if done.is_set():
+                    raise _Lost()
+            ready = first_content(response) if stream else None
+        except Exception as e:
+            with lock:
+                waiting.pop(model, None)
+            if isinstance(e, _Lost) or done.is_set():
+                # Somebody else has already won
+                logger.debug(f"Closing the losing response from {model}.")
+                close_stream(response)
+            else:
+                results.put((model, None, None, e))
+            return
+
+        with lock:
+            waiting.pop(model, None)
+            if done.is_set():
+                logger.debug(f"Closing the losing response from {model}.")
+                close_stream(response)
+                return
+            done.set()
+            results.put((model, response, ready, None))
+        close_waiting()
+
+    candidates = iter(models)
+    running = 0
+    error: Optional[Exception] = None
+
+    def launch() -> bool:
+        nonlocal running
+        model = next(candidates, None)
+        if model is None:
+            return False
+        logger.debug(f"Sending request to {model}.")
+        threading.Thread(target=attempt, args=(model,), daemon=True).start()
+        running += 1
+        return True
+
+    launch()
+    try:
+        while running:
+            try:
+                model, response, ready, e = results.get(timeout=hedge_after)
+            except queue.Empty:
+                # Slow first token, hedge with the next model
+                if launch():
+                    logger.debug(f"No first token in {hedge_after}s, hedging.")
+                continue
+
+            running -= 1
+            if e is not None:
+                logger.debug(f"{model} failed: {type(e).__name__}: {e}")
+                error = e
+                launch()
+                continue
+
+            logger.debug(f"{model} answered first.")
+            if stream:
+                buffered, rest = ready
+                return model, _chain(buffered, rest, response)
+            return model, response
+    except BaseException:
+        # Interrupted: nobody wins, late responses are closed on arrival
+        with lock:
+            done.set()
+        close_waiting()
+        while not results.empty():
+            response = results.get_nowait()[1]
+            if response is not None:
+                close_stream(response)
+        raise
+
+    # Every model has failed, report the last error
+    assert error is not None
+    raise error
@@ -0,0 +1,288 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import typer
+from pydantic import ValidationError
+
+from llmsh.cli import params
+from llmsh.cli.error_handler import handle_exceptions
+from llmsh.cli.renderer import console
+from llmsh.cli.session import private_opener, sessions_dir
+from llmsh.models.message import Message
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    content,
+    role UNINDEXED,
+    model UNINDEXED,
+    timestamp UNINDEXED,
+    session UNINDEXED,
+    number UNINDEXED
+);
+"""
+
+# Marks around matched words in snippets, replaced with markup later
+_match_start = "\x02"
+_match_end = "\x03"
+
+
+class Hit(NamedTuple):
+    session: str
+    number: int
+    role: str
+    model: Optional[str]
+    timestamp: float
+    snippet: str
+
+
+def match_query(query: str) -> str:
+    # Every word of the query as an FTS5 string, so that punctuation is
+    # never taken for query syntax. All of them must occur in a message,
+    # the last one may be the beginning of a word.
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
+
+class SearchIndex:
+    """Full-text index of saved chat sessions.
+
+    An SQLite FTS5 table next to the session logs. For every session it
+    remembers how far into the log it has read, so an update only parses
+    the lines appended since, in a single transaction. Logs are never
+    written here, the index can be rebuilt from them at any time.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.path = directory / "search.sqlite3"
+        # The index holds the messages, it is as private as the logs.
+        # SQLite gives its journal files the same permissions.
+        os.close(private_opener(str(self.path), os.O_RDWR | os.O_CREAT))
+
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_schema)
+
+    def update(self, session_id: str) -> int:
+        # Index the messages appended to the log since the last update
+        log_path = self.directory / f"{session_id}.jsonl"
+        row = self._db.execute(
+            "SELECT position, count FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        position, count = row or (0, 0)
+        try:
+            size = log_path.stat().st_size
+        except FileNotFoundError:
+            self._remove(session_id)
+            return 0
+
+        # A log that got shorter was repaired after a torn write
+        rewritten = size < position
+        if rewritten:
+            position = count = 0
+        if size == position:
+            return 0
+
+        with open(log_path, "rb") as f:
+            f.seek(position)
+            data = f.read(size - position)
+        # The last line may still be being written
+        data = data[: data.rfind(b"\n") + 1]
+
+        rows = []
+        for line in data.splitlines():
+            try:
+                message = Message.from_json(line)
+            except ValidationError as e:
+                logger.debug(f"Skipping message {count} of {session_id}: {e}")
+            else:
+                rows.append((
+                    message.content,
+                    message.role,
+                    message.model,
+                    message.timestamp,
+                    session_id,
+                    count,
+                ))
+            count += 1
+
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if rewritten:
+                self._db.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+            self._db.executemany(
+                "INSERT INTO messages (content, role, model, timestamp, session, number) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, position, count) VALUES (?, ?, ?)",
+                (session_id, position + len(data), count),
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def sync(self) -> int:
+        # Catch up with sessions written by other processes or before the
+        # index existed, and forget the deleted ones
+        known = dict(self._db.execute("SELECT id, position FROM sessions"))
+        added = 0
+        for log_path in self.directory.glob("*.jsonl"):
+            if known.pop(log_path.stem, None) != log_path.stat().st_size:
+                added += self.update(log_path.stem)
+        for session_id in known:
+            self._remove(session_id)
+        return added
+
+    def clear(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute("DELETE FROM messages")
+        self._db.execute("DELETE FROM sessions")
+        self._db.execute("COMMIT")
+
+    def search(self, query: str, limit: int = 10) -> list[Hit]:
+        # The best match of every session, best sessions first
+        rows = self._db.execute(
+            "SELECT session, number, role, model, timestamp, "
+            "snippet(messages, 0, ?, ?, '…', 16) "
+            "FROM messages WHERE messages MATCH ? ORDER BY rank",
+            (_match_start, _match_end, match_query(query)),
+        )
+        hits: dict[str, Hit] = {}
+        for row in rows:
+            if row[0] not in hits:
+                hits[row[0]] = Hit(*row)
+                if len(hits) >= limit:
+                    break
+        return list(hits.values())
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _remove(self, session_id: str) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+        self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self._db.execute("COMMIT")
+
+
+def open_index(directory: Path) -> Optional[SearchIndex]:
+    # SQLite may be built without FTS5, chats are saved regardless
+    try:
+        return SearchIndex(directory)
+    except sqlite3.Error as e:
+        logger.warning(f"Chat history is not indexed: {e}")
+        return None
+
+
+def _snippet(text: str) -> str:
+    from rich.markup import escape
+
+    text = escape(" ".join(text.split()))
+    return text.replace(_match_start, "[bold yellow]").replace(_match_end, "[/bold yellow]")
+
+
+history = typer.Typer(
+    add_completion=False,
+    context_settings={"help_option_names": ["-h", "--help"]},
+    help="Search saved chat sessions.",
+)
+
+
+@history.command("search", help="Find saved chat sessions by the words in their messages.")
+@handle_exceptions
+def search(
+    query: params.history_query,
+    limit: params.history_limit = 10,
+    open_hit: params.history_open = None,
+    debug: params.debug = settings.debug,
+):
+    if debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    logger.debug(f"query: {query}")
+    logger.debug(f"limit: {limit}")
+    logger.debug(f"open_hit: {open_hit}")
+
+    try:
+        index = SearchIndex(sessions_dir())
+    except sqlite3.Error as e:
+        console.print(f"[red]Search is not available: {e}[/red]")
+        raise typer.Exit(1)
+    added = index.sync()
+    logger.debug(f"Indexed {added} new messages.")
+    hits = index.search(query, limit=max(limit, open_hit or 0))
+    index.close()
+
+    if open_hit:
+        if open_hit > len(hits):
+            console.print(f"[red]There are only {len(hits)} results.[/red]")
+            raise typer.Exit(1)
+        from llmsh.cli.app import loop
+
+        loop(interactive=True, resume=hits[open_hit - 1].session)
+        return
+
+    if not hits:
+        console.print("[blue]Nothing found.[/blue]")
+        raise typer.Exit(1)
+
+    for i, hit in enumerate(hits[:limit], 1):
+        when = datetime.fromtimestamp(hit.timestamp).isoformat(sep=" ", timespec="minutes")
+        author = f"{hit.role} ({hit.model})" if hit.model else hit.role
+        console.print(f"[bold]{i}.[/bold] [blue]{hit.session}[/blue] [dim]{when} {author}[/dim]", highlight=False)
+        console.print(f"   {_snippet(hit.snippet)}", highlight=False)
+        console.print(f"   [dim]llmsh -i --resume {hit.session}[/dim]", highlight=False)
+
+
+@history.command("reindex", help="Rebuild the search index from the saved sessions.")
+@handle_exceptions
+def reindex(
+    debug: params.debug = settings.debug,
+):
+    if debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    try:
+        index = SearchIndex(sessions_dir())
+    except sqlite3.Error as e:
+        console.print(f"[red]Search is not available: {e}[/red]")
+        raise typer.Exit(1)
+    index.clear()
+    added = index.sync()
+    index.close()
+    console.print(f"[blue]Indexed {added} messages.[/blue]", highlight=False)
@@ -0,0 +1,122 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import logging
+from typing import Callable, Iterator, Optional
+
+from llmsh.cli import client, pipeline
+
+
+logger = logging.getLogger(__name__)
+
+MAP_NOTE = (
+    "The input is one part of a larger one that was too large to send at "
+    "once. Answer the request for this part only, the answers for all "
+    "parts are combined later."
+)
+REDUCE_INTRO = (
+    "The input was too large to send at once. It was split into {count} "
+    "consecutive parts and the request was applied to each of them. "
+    "Combine the answers for the parts below into a single answer to the "
+    "request."
+)
+
+
+def reduce_prompt(prompt: Optional[str], partials: list[str]) -> str:
+    parts = [prompt] if prompt else []
+    parts.append(REDUCE_INTRO.format(count=len(partials)))
+    parts += [f"## Part {i}\n\n{p}" for i, p in enumerate(partials, 1)]
+    return "\n\n".join(parts)
+
+
+def _groups(partials: list[str], size: int) -> list[list[str]]:
+    # Consecutive answers that fit into `size`, at least two per group,
+    # so that every level of the tree at least halves their number.
+    groups: list[list[str]] = [[]]
+    used = 0
+    for partial in partials:
+        if len(groups[-1]) >= 2 and used + len(partial) > size:
+            groups.append([])
+            used = 0
+        groups[-1].append(partial)
+        used += len(partial)
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        groups[-2] += groups.pop()
+    return groups
+
+
+def map_reduce(
+    chunks: Iterator[str],
+    prompt: Optional[str],
+    model: str,
+    size: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+    jobs: int = 4,
+) -> str:
+    """Apply the prompt to every chunk and return the prompt that combines them.
+
+    Input that fits into a single chunk is returned as a regular prompt.
+    Otherwise up to `jobs` chunks are sent at once and their answers are
+    combined in a tree of requests, until they fit into `size` characters.
+    The last step is left to the caller, so that it is streamed as usual.
+    """
+    head = list(itertools.islice(chunks, 2))
+    if len(head) < 2:
+        return pipeline.join_prompt(prompt, head[0] if head else "")
+
+    def completer(after: Optional[str]) -> Callable[[str], str]:
+        def complete(text: str) -> str:
+            return client.complete_prompt(
+                prompt=text,
+                model=model,
+                before=before,
+                after=after,
+                max_tokens=max_tokens,
+                retries=retries,
+                rate_limit=rate_limit,
+            )
+
+        return complete
+
+    # Only the parts of the input are answered with the note, the
+    # requests that combine answers are told so by their prompt
+    partials: list[str] = []
+    count = pipeline.run_ordered(
+        records=(pipeline.join_prompt(prompt, c) for c in itertools.chain(head, chunks)),
+        complete=completer("\n\n".join(p for p in (after, MAP_NOTE) if p)),
+        write=partials.append,
+        jobs=jobs,
+    )
+    logger.debug(f"Mapped {count} chunks.")
+
+    while len(partials) > 1 and sum(len(p) for p in partials) > size:
+        groups = _groups(partials, size)
+        if len(groups) == 1:
+            # The caller combines the last few answers
+            break
+        partials = []
+        pipeline.run_ordered(
+            records=(reduce_prompt(prompt, g) for g in groups),
+            complete=completer(after),
+            write=partials.append,
+            jobs=jobs,
+        )
+        logger.debug(f"Reduced to {len(partials)} answers.")
+
+    return reduce_prompt(prompt, partials)
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Optional
+from enum import Enum
+from pathlib import Path
+from typing import List, Optional
 from typing_extensions import Annotated
 
 import typer
@@ -33,6 +35,30 @@ model = Annotated[
         help="Model name.",
     ),
 ]
+fallback = Annotated[
+    Optional[str],
+    typer.Option(
+        "--fallback",
+        help="Comma-separated models to try, in order, when the model fails or is slow to answer.",
+        show_default=False,
+    ),
+]
+compare = Annotated[
+    Optional[str],
+    typer.Option(
+        "--compare",
+        help="Comma separated models to send the prompt to at once, instead of --model. Answers are shown side by side.",
+        show_default=False,
+    ),
+]
+hedge_after = Annotated[
+    Optional[float],
+    typer.Option(
+        "--hedge-after",
+        help="Seconds to wait for the first token before also sending the request to the next fallback model.",
+        show_default="never",
+    ),
+]
 before = Annotated[
     Optional[str],
     typer.Option(
@@ -60,6 +86,44 @@ limit = Annotated[
         show_default="unlimited",
     ),
 ]
+context_tokens = Annotated[
+    Optional[int],
+    typer.Option(
+        "--context-tokens",
+        help="Drop the oldest messages to keep the context within this many tokens, including --max-tokens.",
+        show_default="unlimited",
+    ),
+]
+attach_bytes = Annotated[
+    Optional[int],
+    typer.Option(
+        "--attach-bytes",
+        help="Maximum number of bytes attached with @path, @glob and @dir/ references in a single prompt. Unlimited when 0.",
+    ),
+]
+compact = Annotated[
+    Optional[int],
+    typer.Option(
+        "--compact",
+        help="In chat mode, summarize older messages in the background once the history is over this many tokens.",
+        show_default=False,
+    ),
+]
+compact_model = Annotated[
+    Optional[str],
+    typer.Option(
+        "--compact-model",
+        help="Model that summarizes older messages.",
+        show_default="--model",
+    ),
+]
+prompt_cache = Annotated[
+    bool,
+    typer.Option(
+        "--prompt-cache",
+        help="Mark the system prompt and the older messages as cacheable for providers that support it.",
+    ),
+]
 tokens = Annotated[
     Optional[int],
     typer.Option(
@@ -69,6 +133,21 @@ tokens = Annotated[
         show_default="unlimited",
     ),
 ]
+retries = Annotated[
+    int,
+    typer.Option(
+        "--retries",
+        help="Retry rate limited, unavailable or timed out requests this many times.",
+    ),
+]
+rate_limit = Annotated[
+    Optional[float],
+    typer.Option(
+        "--rate-limit",
+        help="Maximum number of requests per minute to a model.",
+        show_default="unlimited",
+    ),
+]
 no_stream = Annotated[
     bool,
     typer.Option(
@@ -84,6 +163,29 @@ interactive = Annotated[
         help="Interactive CHAT mode.",
     ),
 ]
+resume = Annotated[
+    Optional[str],
+    typer.Option(
+        "--resume",
+        "-r",
+        help="Resume a saved chat session by its id, or the latest one with 'last'. Implies --interactive.",
+        show_default=False,
+    ),
+]
+prewarm = Annotated[
+    bool,
+    typer.Option(
+        "--prewarm/--no-prewarm",
+        help="Connect to the provider in interactive chat mode while you type.",
+    ),
+]
+save = Annotated[
+    bool,
+    typer.Option(
+        "--save/--no-save",
+        help="Save interactive chat sessions to disk.",
+    ),
+]
 debug = Annotated[
     bool,
     typer.Option(
@@ -91,3 +193,201 @@ debug = Annotated[
         help="Print debug information.",
     ),
 ]
+each_line = Annotated[
+    bool,
+    typer.Option(
+        "--each-line",
+        help="Send every line of piped input as a separate prompt.",
+    ),
+]
+each_record = Annotated[
+    bool,
+    typer.Option(
+        "--each-record",
+        help="Send every NUL-separated record of piped input as a separate prompt.",
+    ),
+]
+map_reduce = Annotated[
+    bool,
+    typer.Option(
+        "--map-reduce",
+        help="Split piped input that is too large for one request into chunks, apply the prompt to each and combine the answers.",
+    ),
+]
+chunk_tokens = Annotated[
+    int,
+    typer.Option(
+        "--chunk-tokens",
+        help="Approximate size of a --map-reduce chunk in tokens.",
+    ),
+]
+chunk_overlap = Annotated[
+    int,
+    typer.Option(
+        "--chunk-overlap",
+        help="Approximate number of tokens repeated from the end of a --map-reduce chunk at the start of the next one.",
+    ),
+]
+jobs = Annotated[
+    int,
+    typer.Option(
+        "--jobs",
+        "-j",
+        help="Number of requests kept in flight with --each-line, --each-record or --map-reduce.",
+    ),
+]
+raw = Annotated[
+    bool,
+    typer.Option(
+        "--raw",
+        help="Print the response as is, without markdown rendering. Always on when output is not a terminal.",
+    ),
+]
+flush_bytes = Annotated[
+    int,
+    typer.Option(
+        "--flush-bytes",
+        help="Flush raw output after this many bytes. Flushes every chunk when 0.",
+    ),
+]
+batch_input = Annotated[
+    Path,
+    typer.Argument(
+        help="JSONL file with one request per line: {\"prompt\": ..., \"id\": ...}.",
+        show_default=False,
+    ),
+]
+batch_output = Annotated[
+    Path,
+    typer.Argument(
+        help="JSONL file the results are appended to.",
+        show_default=False,
+    ),
+]
+workers = Annotated[
+    int,
+    typer.Option(
+        "--workers",
+        "-w",
+        help="Number of requests sent concurrently.",
+    ),
+]
+model_limit = Annotated[
+    Optional[List[str]],
+    typer.Option(
+        "--model-limit",
+        help="Maximum concurrent requests for a model, as MODEL=N. Can be repeated.",
+        show_default=False,
+    ),
+]
+checkpoint = Annotated[
+    Optional[Path],
+    typer.Option(
+        "--checkpoint",
+        help="Checkpoint file used to resume an interrupted run.",
+        show_default="<output>.checkpoint",
+    ),
+]
+history_query = Annotated[
+    str,
+    typer.Argument(
+        help="Words to look for in saved chat sessions.",
+        show_default=False,
+    ),
+]
+history_limit = Annotated[
+    int,
+    typer.Option(
+        "--limit",
+        "-l",
+        help="Maximum number of sessions to show.",
+    ),
+]
+history_open = Annotated[
+    Optional[int],
+    typer.Option(
+        "--open",
+        help="Resume the session of the Nth result in interactive chat mode.",
+        show_default=False,
+    ),
+]
+cache = Annotated[
+    bool,
+    typer.Option(
+        "--cache",
+        help="Reuse responses to identical requests from the local cache.",
+    ),
+]
+semantic_cache = Annotated[
+    bool,
+    typer.Option(
+        "--semantic-cache",
+        help="Reuse responses to similar requests from the local cache. Requires numpy.",
+    ),
+]
+semantic_threshold = Annotated[
+    float,
+    typer.Option(
+        "--semantic-threshold",
+        help="Minimum cosine similarity of a request to a cached one for --semantic-cache.",
+        min=-1.0,
+        max=1.0,
+    ),
+]
+embedding_model = Annotated[
+    str,
+    typer.Option(
+        "--embedding-model",
+        help="Embedding model for --semantic-cache, 'local' for a built-in one that needs no network.",
+    ),
+]
+cache_ttl = Annotated[
+    int,
+    typer.Option(
+        "--cache-ttl",
+        help="Number of seconds a cached response stays valid.",
+    ),
+]
+cache_size = Annotated[
+    int,
+    typer.Option(
+        "--cache-size",
+        help="Maximum size of the response cache in megabytes.",
+    ),
+]
+stats = Annotated[
+    bool,
+    typer.Option(
+        "--stats",
+        help="Print timings and throughput of every request to stderr.",
+    ),
+]
+metrics_file = Annotated[
+    Optional[Path],
+    typer.Option(
+        "--metrics-file",
+        help="Append timings of every request to this file as JSON lines.",
+        show_default=False,
+    ),
+]
+class OutputFormat(str, Enum):
+    text = "text"
+    jsonl = "jsonl"
+
+
+output_format = Annotated[
+    OutputFormat,
+    typer.Option(
+        "--output-format",
+        help="Print the response as text, or as JSON lines with an event per delta and a final event with usage.",
+    ),
+]
+output = Annotated[
+    Optional[Path],
+    typer.Option(
+        "--output",
+        "-o",
+        help="Also write the response to this file as JSON lines, like --output-format jsonl.",
+        show_default=False,
+    ),
+]
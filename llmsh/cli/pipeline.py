@@ -0,0 +1,147 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections import deque
+from typing import BinaryIO, Callable, Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_read_size = 64 * 1024
+
+
+def read_all(stream: BinaryIO) -> str:
+    return stream.read().decode("utf-8", errors="replace")
+
+
+def iter_records(
+    stream: BinaryIO, separator: bytes = b"\n", keep_empty: bool = False
+) -> Iterator[str]:
+    # Read the stream in large binary blocks and split them into records.
+    # An unfinished record at the end of a block waits for the next one.
+    buffer = bytearray()
+    while block := stream.read(_read_size):
+        buffer += block
+        end = buffer.rfind(separator)
+        if end < 0:
+            continue
+
+        for record in bytes(buffer[:end]).split(separator):
+            if (text := _decode(record, separator)) or keep_empty:
+                yield text
+        del buffer[:end + len(separator)]
+
+    if text := _decode(bytes(buffer), separator):
+        yield text
+
+
+def iter_chunks(stream: BinaryIO, size: int, overlap: int = 0) -> Iterator[str]:
+    # Group lines into chunks of up to `size` characters, cut at a blank
+    # line once the chunk is at least half full. The last lines of a chunk,
+    # up to `overlap` characters, are repeated at the start of the next one.
+    overlap = min(overlap, size // 2)
+    lines: deque[str] = deque()
+    used = 0
+    # Whether text was added since the last cut, the overlap alone was
+    # already sent at the end of the previous chunk
+    fresh = False
+
+    def cut() -> str:
+        nonlocal lines, used, fresh
+        fresh = False
+        chunk = "\n".join(lines)
+        kept: deque[str] = deque()
+        kept_size = 0
+        while lines and kept_size + len(lines[-1]) + 1 <= overlap:
+            line = lines.pop()
+            kept.appendleft(line)
+            kept_size += len(line) + 1
+        lines, used = kept, kept_size
+        return chunk
+
+    for line in iter_records(stream, b"\n", keep_empty=True):
+        # A line longer than a chunk is split on its own
+        while len(line) > size:
+            if lines:
+                yield cut()
+                lines.clear()
+                used = 0
+            yield line[:size]
+            line = line[size:]
+
+        if lines and used + len(line) + 1 > size:
+            yield cut()
+            # The overlap gives way, oldest lines first, to a line that
+            # wouldn't fit next to it
+            while lines and used + len(line) + 1 > size:
+                used -= len(lines.popleft()) + 1
+        elif not line and used >= size // 2:
+            # Paragraph boundary
+            yield cut()
+            continue
+
+        lines.append(line)
+        used += len(line) + 1
+        fresh = fresh or bool(line)
+
+    if fresh:
+        yield "\n".join(lines)
+
+
+def _decode(record: bytes, separator: bytes) -> str:
+    if separator == b"\n":
+        record = record.rstrip(b"\r")
+    return record.decode("utf-8", errors="replace")
+
+
+def run_ordered(
+    records: Iterator[str],
+    complete: Callable[[str], str],
+    write: Callable[[str], None],
+    jobs: int = 4,
+) -> int:
+    # Keep at most `jobs` requests in flight. Results are written in the
+    # same order as the input, as soon as the oldest pending one is done.
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    jobs = max(jobs, 1)
+    count = 0
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for record in records:
+                pending.append(executor.submit(complete, record))
+                if len(pending) >= jobs:
+                    write(pending.popleft().result())
+                    count += 1
+
+            while pending:
+                write(pending.popleft().result())
+                count += 1
+
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    logger.debug(f"Processed {count} records.")
+    return count
+
+
+def join_prompt(prompt: Optional[str], text: str) -> str:
+    # Piped text is appended to the prompt given on the command line.
+    if not text:
+        return prompt or ""
+    return f"{prompt}\n{text}" if prompt else text
@@ -12,11 +12,241 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Generator
+import re
+import time
+from typing import Any, BinaryIO, Optional
 
-from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.segment import Segment
 
 
 console = Console()
+
+_fence_re = re.compile(r"^\s*(`{3,}|~{3,})")
+_list_item_re = re.compile(r"^([-*+]|\d{1,9}[.)])(\s|$)")
+_thematic_break_re = re.compile(r"^ {0,3}([-*_])(\s*\1){2,}\s*$")
+
+
+class _TrimLeadingBlankLines:
+    # Lists are rendered with a blank line above them. A list that is
+    # printed one item at a time must not get that blank line repeated.
+
+    def __init__(self, renderable: Any) -> None:
+        self.renderable = renderable
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        lines = console.render_lines(self.renderable, options, pad=False)
+        start = 0
+        while start < len(lines) and not "".join(
+            segment.text for segment in lines[start]
+        ).strip():
+            start += 1
+        for line in lines[start:]:
+            yield from line
+            yield Segment.line()
+
+
+class MarkdownStream:
+    """Render streamed markdown without re-parsing the whole response.
+
+    Finished blocks (paragraphs, closed code fences, list items) are
+    printed once and never touched again. Only the open block at the end
+    is re-rendered in a `Live` display, and redraws are coalesced: at most
+    one every `min_interval` seconds, less often as the open block grows
+    past `size_budget` characters.
+    """
+
+    def __init__(
+        self,
+        console: Console,
+        min_interval: float = 0.05,
+        size_budget: int = 2048,
+    ) -> None:
+        from rich.live import Live
+        from rich.text import Text
+
+        self.console = console
+        self.min_interval = min_interval
+        self.size_budget = size_budget
+
+        self._parts: list[str] = []
+        self._tail = ""
+        self._scan = 0
+        self._fence: Optional[str] = None
+        self._printed = False
+        self._gap = False
+        self._last_draw = 0.0
+        self._dirty = False
+        self._live = Live(
+            Text(""),
+            console=console,
+            auto_refresh=False,
+            vertical_overflow="visible",
+        )
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __enter__(self) -> "MarkdownStream":
+        self._live.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.flush()
+        self._live.stop()
+
+    def feed(self, part: str) -> None:
+        if not part:
+            return
+
+        self._parts.append(part)
+        self._tail += part
+        self._dirty = True
+        self._freeze_finished_blocks()
+
+        now = time.monotonic()
+        interval = self.min_interval * (1 + len(self._tail) // self.size_budget)
+        if now - self._last_draw >= interval:
+            self._draw(now)
+
+    def flush(self) -> None:
+        if self._dirty:
+            self._draw(time.monotonic())
+
+    def _draw(self, now: float) -> None:
+        self._live.update(self._render(self._tail), refresh=True)
+        self._last_draw = now
+        self._dirty = False
+
+    def _render(self, block: str) -> Any:
+        from rich.console import Group
+        from rich.markdown import Markdown
+        from rich.text import Text
+
+        if not block.strip():
+            return Text("")
+
+        renderable: Any = Markdown(block)
+        if self._printed and _list_item_re.match(block):
+            renderable = _TrimLeadingBlankLines(renderable)
+        if self._gap:
+            renderable = Group(Text(""), renderable)
+        return renderable
+
+    def _freeze(self, end: int, gap: bool) -> None:
+        # Print the block that ends at `end` above the live display
+        # and keep only the rest in the open tail.
+        block = self._tail[:end]
+        if block.strip():
+            self._live.console.print(self._render(block))
+            self._printed = True
+            self._gap = False
+        self._gap = self._gap or (gap and self._printed)
+        self._tail = self._tail[end:]
+        self._scan -= end
+        self._dirty = True
+
+    def _freeze_finished_blocks(self) -> None:
+        # Only complete lines are inspected, each of them exactly once.
+        while (newline := self._tail.find("\n", self._scan)) >= 0:
+            start = self._scan
+            line = self._tail[start:newline]
+            self._scan = newline + 1
+
+            if self._fence:
+                stripped = line.strip()
+                if stripped.startswith(self._fence) and not stripped.strip(
+                    self._fence[0]
+                ):
+                    self._fence = None
+                    self._freeze(self._scan, gap=True)
+                continue
+
+            if match := _fence_re.match(line):
+                if not line[0].isspace():
+                    self._freeze(start, gap=True)
+                self._fence = match.group(1)
+                continue
+
+            if not line.strip():
+                self._freeze(self._scan, gap=True)
+                continue
+
+            if (
+                start > 0
+                and _list_item_re.match(line)
+                and not _thematic_break_re.match(line)
+                and _list_item_re.match(self._tail)
+            ):
+                self._freeze(start, gap=False)
+
+
+class RawStream:
+    """Write streamed text straight to a binary file, bypassing rich.
+
+    Used when stdout is not a terminal. The output is flushed after every
+    `flush_bytes` bytes, or after every part when `flush_bytes` is 0.
+    """
+
+    def __init__(self, file: BinaryIO, flush_bytes: int = 0) -> None:
+        self.flush_bytes = flush_bytes
+
+        self._file = file
+        self._parts: list[str] = []
+        self._pending = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __enter__(self) -> "RawStream":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        # Terminate the output with a newline like console.print does.
+        if self._parts and not self._parts[-1].endswith("\n"):
+            self._file.write(b"\n")
+        self.flush()
+
+    def feed(self, part: str) -> None:
+        if not part:
+            return
+
+        self._parts.append(part)
+        self._pending += self._file.write(part.encode("utf-8"))
+        if self._pending >= self.flush_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+
+
+class NullStream:
+    """Collect streamed text without printing it.
+
+    Used when stdout gets JSON events instead of the text.
+    """
+
+    def __init__(self) -> None:
+        self._parts: list[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __enter__(self) -> "NullStream":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def feed(self, part: str) -> None:
+        if part:
+            self._parts.append(part)
+
+    def flush(self) -> None:
+        pass
@@ -0,0 +1,227 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_retryable_errors = (
+    "RateLimitError",
+    "ServiceUnavailableError",
+    "InternalServerError",
+    "BadGatewayError",
+    "Timeout",
+    "APIConnectionError",
+)
+_base_delay = 1.0
+_max_delay = 60.0
+
+
+@lru_cache(maxsize=None)
+def _resolve_retryable_errors() -> tuple:
+    from litellm import exceptions
+
+    return tuple(
+        cls
+        for name in _retryable_errors
+        if (cls := getattr(exceptions, name, None)) is not None
+    )
+
+
+def is_retryable(e: Exception) -> bool:
+    return isinstance(e, _resolve_retryable_errors())
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    # Providers tell how long to wait in the Retry-After header, either in
+    # seconds or as an HTTP date. Some use retry-after-ms instead.
+    headers: Any = getattr(e, "litellm_response_headers", None) or getattr(
+        getattr(e, "response", None), "headers", None
+    )
+    if not headers:
+        return None
+
+    try:
+        if value := headers.get("retry-after-ms"):
+            return float(value) / 1000
+        if value := headers.get("retry-after"):
+            try:
+                return float(value)
+            except ValueError:
+                return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(_max_delay, _base_delay * 2 ** attempt))
+
+
+class Limiter:
+    """Token bucket shared by all requests to the same model.
+
+    Allows `rate` requests per second on average with bursts of up to
+    `burst` requests. Without a rate it only enforces pauses requested
+    after a rate limit error, so that concurrent requests back off too.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # Take a token if there is one, otherwise tell how long to wait
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if delay > 0:
+                return delay
+            if not self.rate:
+                return 0.0
+
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        # Returns the number of seconds spent waiting
+        waited = 0.0
+        while (delay := self._reserve()) > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    async def acquire_async(self) -> float:
+        import asyncio
+
+        waited = 0.0
+        while (delay := self._reserve()) > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds
+            )
+
+
+_limiters: dict[str, Limiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(model: str, rate: Optional[float] = None) -> Limiter:
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = Limiter(rate=rate, burst=max(int(rate or 1), 1))
+        return _limiters[model]
+
+
+def _retry_delay(e: Exception, model: str, attempt: int, retries: int) -> Optional[float]:
+    # None when the error should not be retried
+    if attempt >= retries or not is_retryable(e):
+        return None
+
+    delay = retry_after(e)
+    if delay is None:
+        delay = backoff(attempt)
+    delay = max(delay, 0.0)
+    logger.debug(
+        f"{type(e).__name__} from {model}, "
+        f"retry {attempt + 1}/{retries} in {delay:.2f}s."
+    )
+    return delay
+
+
+def _log_success(model: str, attempt: int, waited: float) -> None:
+    if attempt or waited:
+        logger.debug(
+            f"Request to {model} succeeded after {attempt} retries "
+            f"and {waited:.2f}s of waiting."
+        )
+
+
+def call_with_retry(
+    f: Callable[[], T],
+    model: str,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+) -> T:
+    # `rate_limit` is in requests per minute
+    bucket = limiter(model, rate_limit / 60 if rate_limit else None)
+    waited = 0.0
+    attempt = 0
+    while True:
+        waited += bucket.acquire()
+        try:
+            result = f()
+        except Exception as e:
+            if (delay := _retry_delay(e, model, attempt, retries)) is None:
+                raise
+
+            # Everyone sending to this model waits, not just this request
+            bucket.pause(delay)
+            attempt += 1
+            continue
+
+        _log_success(model, attempt, waited)
+        return result
+
+
+async def call_with_retry_async(
+    f: Callable[[], Awaitable[T]],
+    model: str,
+    retries: int = 0,
+    rate_limit: Optional[float] = None,
+) -> T:
+    bucket = limiter(model, rate_limit / 60 if rate_limit else None)
+    waited = 0.0
+    attempt = 0
+    while True:
+        waited += await bucket.acquire_async()
+        try:
+            result = await f()
+        except Exception as e:
+            if (delay := _retry_delay(e, model, attempt, retries)) is None:
+                raise
+
+            bucket.pause(delay)
+            attempt += 1
+            continue
+
+        _log_success(model, attempt, waited)
+        return result
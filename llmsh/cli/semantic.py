@@ -0,0 +1,346 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+from abc import ABC, abstractmethod
+import re
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from llmsh.cli.cache import request_key
+from llmsh.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+"""
+
+# Evict expired and least recently used entries every so many writes
+_evict_every = 32
+# Entries written after the snapshot of the index are read from the
+# database, the snapshot is rewritten once there are this many of them.
+_snapshot_every = 256
+# Best matches checked against the database, some may have been evicted
+_candidates = 8
+
+_numbers = re.compile(r"\d+(?:[.,]\d+)*")
+_spaces = re.compile(r"\s+")
+_words = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return _spaces.sub(" ", text.lower()).strip()
+
+
+class Embedder(ABC):
+    """Turns texts into vectors, subclasses are the embedding backends.
+
+    `name` identifies the vector space, entries embedded by a different
+    backend are stored separately and never compared.
+    """
+
+    name: str
+
+    @abstractmethod
+    def embed(self, text: str) -> np.ndarray: ...
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic embedding of words and word pairs, without network.
+
+    Every feature is hashed into one of `dim` signed buckets. Texts that
+    share most of their words end up close to each other.
+    """
+
+    def __init__(self, dim: int = 512) -> None:
+        self.dim = dim
+        self.name = f"local-{dim}"
+
+    def embed(self, text: str) -> np.ndarray:
+        words = _words.findall(text)
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        hashes = np.fromiter(
+            (zlib.crc32(f.encode("utf-8")) for f in features),
+            dtype=np.uint32,
+            count=len(features),
+        )
+        vector = np.zeros(self.dim, dtype=np.float32)
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        return vector
+
+
+class LiteLLMEmbedder(Embedder):
+    """Embeddings from a provider model, e.g. `text-embedding-3-small`."""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.name = model
+
+    def embed(self, text: str) -> np.ndarray:
+        import litellm
+
+        response = litellm.embedding(model=self.model, input=[text])
+        return np.asarray(response.data[0]["embedding"], dtype=np.float32)
+
+
+def get_embedder(name: str) -> Embedder:
+    return HashingEmbedder() if name == "local" else LiteLLMEmbedder(name)
+
+
+def _text(content: Any) -> str:
+    # Content is either a string or a list of content blocks
+    if isinstance(content, str):
+        return content
+    return "\n".join(
+        block.get("text", "") for block in content or [] if isinstance(block, dict)
+    )
+
+
+def request_parts(context: list[dict], **params: Any) -> tuple[str, int]:
+    """Text to embed and the scope it is compared within.
+
+    Only the last user message is embedded. Everything else, the system
+    prompts, the earlier turns, the model and its parameters, must match
+    exactly and is hashed into the scope. So are the numbers in the
+    message: a different port, id or operand is a different question,
+    however small a part of the text it is.
+    """
+    last = max(
+        (i for i, m in enumerate(context) if m["role"] == settings.user_role),
+        default=-1,
+    )
+    text = normalize(_text(context[last]["content"])) if last >= 0 else ""
+
+    rest = [
+        {"role": m["role"], "content": _text(m["content"])}
+        for i, m in enumerate(context)
+        if i != last
+    ]
+    scope = int(request_key(rest, numbers=_numbers.findall(text), **params)[:15], 16)
+    return text, scope
+
+
+class SemanticCache:
+    """Responses to similar requests, found by cosine similarity.
+
+    Entries are stored in SQLite next to the exact response cache. Their
+    vectors are also kept in a NumPy file that is memory-mapped, so a
+    lookup is a single matrix product over all entries plus the few
+    written since the file was last rewritten. Entries older than `ttl`
+    seconds are never returned and least recently used ones are evicted
+    once the total size goes over `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        embedder: Embedder,
+        threshold: float,
+        ttl: float,
+        max_bytes: int,
+    ) -> None:
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = re.sub(r"[^\w.-]", "_", embedder.name)
+        self.path = directory / f"{stem}.sqlite3"
+        self.index_path = directory / f"{stem}.npy"
+
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_schema)
+        self._writes = 0
+        self._index: Optional[np.ndarray] = None
+        # The last request embedded, which is stored after a miss
+        self._last: Optional[tuple[str, np.ndarray]] = None
+
+    def get(self, context: list[dict], **params: Any) -> Optional[str]:
+        text, scope = request_parts(context, **params)
+        try:
+            query = self._embed(text)
+        except Exception as e:
+            # The request is sent as if the cache was empty
+            logger.warning(f"Failed to embed the request: {e}")
+            return None
+
+        # The snapshot and the entries written after it
+        segments = self._load()
+        ids = np.concatenate([s["id"] for s in segments])
+        if not len(ids):
+            logger.debug("Semantic cache miss: empty")
+            return None
+
+        scores = np.concatenate([s["vector"] @ query for s in segments])
+        scores[np.concatenate([s["scope"] for s in segments]) != scope] = -1.0
+        count = min(_candidates, len(scores))
+        best = np.argpartition(-scores, count - 1)[:count]
+
+        now = time.time()
+        for i in best[np.argsort(-scores[best])]:
+            if scores[i] < self.threshold:
+                break
+            row = self._db.execute(
+                "SELECT content FROM entries WHERE id = ? AND created >= ?",
+                (int(ids[i]), now - self.ttl),
+            ).fetchone()
+            if row is None:
+                continue
+            logger.debug(f"Semantic cache hit: {int(ids[i])}, similarity {scores[i]:.3f}")
+            self._db.execute(
+                "UPDATE entries SET accessed = ? WHERE id = ?",
+                (now, int(ids[i])),
+            )
+            return row[0]
+
+        logger.debug(f"Semantic cache miss: best similarity {scores.max():.3f}")
+        return None
+
+    def set(self, context: list[dict], content: str, **params: Any) -> None:
+        text, scope = request_parts(context, **params)
+        try:
+            vector = self._embed(text)
+        except Exception as e:
+            logger.warning(f"Failed to embed the request: {e}")
+            return
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO entries (scope, vector, content, size, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                scope,
+                vector.tobytes(),
+                content,
+                len(content.encode("utf-8")) + vector.nbytes,
+                now,
+                now,
+            ),
+        )
+        self._writes += 1
+        if self._writes % _evict_every == 1:
+            self.evict()
+
+    def evict(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            expired = self._db.execute(
+                "DELETE FROM entries WHERE created < ?",
+                (time.time() - self.ttl,),
+            ).rowcount
+            oversized = self._db.execute(
+                """
+                DELETE FROM entries WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, SUM(size) OVER (
+                            ORDER BY accessed DESC, id
+                        ) AS total
+                        FROM entries
+                    ) WHERE total > ?
+                )
+                """,
+                (self.max_bytes,),
+            ).rowcount
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        logger.debug(f"Semantic cache evicted {expired} expired and {oversized} least recently used entries.")
+        # Evicted entries left in the index are skipped on lookup, it is
+        # rewritten once they are a noticeable part of it
+        if expired + oversized > len(self._load()[0]) // 10:
+            self._snapshot()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _embed(self, text: str) -> np.ndarray:
+        if self._last is None or self._last[0] != text:
+            self._last = text, self._unit(self.embedder.embed(text))
+        return self._last[1]
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _dtype(self, dim: int) -> np.dtype:
+        return np.dtype([("id", "<i8"), ("scope", "<i8"), ("vector", "<f4", (dim,))])
+
+    def _rows(self, after: int) -> list[tuple[int, int, bytes]]:
+        return self._db.execute(
+            "SELECT id, scope, vector FROM entries WHERE id > ? ORDER BY id",
+            (after,),
+        ).fetchall()
+
+    def _records(self, rows: list[tuple[int, int, bytes]], dim: int) -> np.ndarray:
+        records = np.empty(len(rows), dtype=self._dtype(dim))
+        if rows:
+            ids, scopes, vectors = zip(*rows)
+            records["id"] = ids
+            records["scope"] = scopes
+            records["vector"] = np.frombuffer(b"".join(vectors), dtype=np.float32).reshape(-1, dim)
+        return records
+
+    def _snapshot(self) -> np.ndarray:
+        # Rewrite the index from the database. Other processes keep using
+        # the old file until they open it again.
+        rows = self._rows(0)
+        dim = len(rows[0][2]) // 4 if rows else 0
+        records = self._records(rows, dim)
+        temporary = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary, "wb") as f:
+            np.save(f, records)
+        os.replace(temporary, self.index_path)
+        logger.debug(f"Semantic cache index written with {len(records)} entries.")
+        self._index = records
+        return records
+
+    def _load(self) -> list[np.ndarray]:
+        if self._index is None:
+            try:
+                self._index = np.load(self.index_path, mmap_mode="r")
+            except (OSError, ValueError):
+                self._index = self._snapshot()
+
+        index = self._index
+        last = int(index["id"][-1]) if len(index) else 0
+        rows = self._rows(last)
+        if len(rows) >= _snapshot_every or (rows and not len(index)):
+            return [self._snapshot()]
+        if rows:
+            dim = index.dtype["vector"].shape[0]
+            return [index, self._records(rows, dim)]
+        return [index]
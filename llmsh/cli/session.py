@@ -0,0 +1,211 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import secrets
+import struct
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from llmsh.models.message import Message
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where sessions are not locked
+    fcntl = None  # type: ignore[assignment]
+
+
+logger = logging.getLogger(__name__)
+
+# Offsets of messages in the log are stored as unsigned 64-bit integers
+_offset = struct.Struct("<Q")
+_batch_size = 64
+
+
+def sessions_dir() -> Path:
+    base = os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share"
+    return Path(base) / "llmsh" / "sessions"
+
+
+def private_opener(path: str, flags: int) -> int:
+    # Chats may contain anything, only their owner can read them
+    return os.open(path, flags, 0o600)
+
+
+@contextmanager
+def _locked(f: BinaryIO) -> Iterator[None]:
+    # Another process may be writing to the same session
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def new_session_id() -> str:
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(2)}"
+
+
+def last_session_id(directory: Path) -> Optional[str]:
+    logs = sorted(directory.glob("*.jsonl"), key=lambda p: p.stat().st_mtime)
+    return logs[-1].stem if logs else None
+
+
+class Session:
+    """Chat history stored as an append-only log of messages.
+
+    `<id>.jsonl` holds one message per line. `<id>.idx` holds the byte
+    offset of every line, so any tail of the log can be read without
+    parsing what comes before it. The log is written first and synced
+    before its offsets are added to the index, and a torn write at the
+    end of either file is repaired the next time the session is opened.
+    Writers take a lock on the log, so several processes can append to
+    the same session.
+    """
+
+    def __init__(self, directory: Path, session_id: str) -> None:
+        self.id = session_id
+        self.log_path = directory / f"{session_id}.jsonl"
+        self.index_path = directory / f"{session_id}.idx"
+
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._log = open(self.log_path, "a+b", opener=private_opener)
+        self._index = open(self.index_path, "a+b", opener=private_opener)
+        with _locked(self._log):
+            self._recover()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _recover(self) -> None:
+        log_size = os.fstat(self._log.fileno()).st_size
+        index_size = os.fstat(self._index.fileno()).st_size
+
+        # Drop a partially written offset and offsets past the end of the log
+        count = index_size // _offset.size
+        while count and self._offset_at(count - 1) >= log_size:
+            count -= 1
+
+        # The last indexed line itself may be torn
+        position = 0
+        if count:
+            position = self._offset_at(count - 1)
+            self._log.seek(position)
+            line = self._log.readline()
+            if line.endswith(b"\n"):
+                position += len(line)
+            else:
+                count -= 1
+        self._index.truncate(count * _offset.size)
+
+        # Index lines that made it into the log but not into the index,
+        # and cut off a partially written last line.
+        self._log.seek(position)
+        offsets = []
+        while line := self._log.readline():
+            if not line.endswith(b"\n"):
+                break
+            offsets.append(position)
+            position += len(line)
+        if position < log_size:
+            logger.debug(f"Truncating torn write at {position} in {self.log_path}")
+            self._log.truncate(position)
+        if offsets:
+            self._index.write(b"".join(_offset.pack(o) for o in offsets))
+            self._index.flush()
+        self._count = count + len(offsets)
+
+    def _offset_at(self, position: int) -> int:
+        self._index.seek(position * _offset.size)
+        return _offset.unpack(self._index.read(_offset.size))[0]
+
+    def _read(self, start: int, stop: int) -> list[Message]:
+        # Messages with numbers in [start, stop)
+        if start >= stop:
+            return []
+        self._log.seek(self._offset_at(start))
+        return [
+            Message.from_json(self._log.readline())
+            for _ in range(stop - start)
+        ]
+
+    def tail(self, count: Optional[int] = None) -> list[Message]:
+        start = 0 if count is None else max(self._count - count, 0)
+        return self._read(start, self._count)
+
+    def newest_first(self) -> Iterator[Message]:
+        # From the newest message to the oldest, read in batches
+        stop = self._count
+        while stop > 0:
+            start = max(stop - _batch_size, 0)
+            yield from reversed(self._read(start, stop))
+            stop = start
+
+    def append(self, messages: list[Message]) -> None:
+        if not messages:
+            return
+
+        lines = [m.to_json().encode("utf-8") + b"\n" for m in messages]
+        with _locked(self._log):
+            # Pick up messages appended by other processes since
+            self._recover()
+            self._log.seek(0, os.SEEK_END)
+            position = self._log.tell()
+            offsets = []
+            for line in lines:
+                offsets.append(position)
+                position += len(line)
+
+            self._log.write(b"".join(lines))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(b"".join(_offset.pack(o) for o in offsets))
+            self._index.flush()
+            self._count += len(messages)
+
+    def close(self) -> None:
+        self._log.close()
+        self._index.close()
+
+
+def load_history(
+    session: Session,
+    limit: Optional[int] = None,
+    budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[Message], int]] = None,
+) -> list[Message]:
+    # Read only as many of the latest messages as the context can take
+    if limit:
+        return session.tail(limit)
+    if budget is None or not count_tokens:
+        return session.tail()
+
+    history: list[Message] = []
+    used = 0
+    for message in session.newest_first():
+        used += count_tokens(message)
+        if used > budget and history:
+            break
+        history.append(message)
+    history.reverse()
+    return history
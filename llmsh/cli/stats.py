@@ -0,0 +1,187 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(p / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class RequestStats:
+    """Timings of a single request.
+
+    Only created when `--stats` or `--metrics-file` is given. The streaming
+    loop goes through `track` and `timed` wrappers instead of the plain
+    response and render function, so nothing is measured otherwise.
+    """
+
+    def __init__(self, model: str, settings_seconds: float = 0.0) -> None:
+        self.model = model
+        self.settings_seconds = settings_seconds
+        self.import_seconds = 0.0
+        self.context_seconds = 0.0
+        self.send_seconds = 0.0
+        self.render_seconds = 0.0
+        self.cached = False
+        self.usage_tokens: Optional[int] = None
+        self.prompt_tokens: Optional[int] = None
+        # Prompt tokens read from and written to the provider's cache
+        self.cache_read_tokens: Optional[int] = None
+        self.cache_write_tokens: Optional[int] = None
+
+        self._started = 0.0
+        self._requested = 0.0
+        self._finished = 0.0
+        self._arrivals: list[float] = []
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+
+    def prepared(self) -> None:
+        self._requested = time.perf_counter()
+        self.context_seconds = self._requested - self._started
+
+    def load(self, f: Callable[[], Any]) -> None:
+        # Libraries imported on first use are timed on their own, so that
+        # the import is not taken for network time
+        started = time.perf_counter()
+        f()
+        self.import_seconds = time.perf_counter() - started
+        self._requested += self.import_seconds
+
+    def sent(self) -> None:
+        self.send_seconds = time.perf_counter() - self._requested
+
+    def finish(self) -> None:
+        self._finished = time.perf_counter()
+
+    def arrived(self) -> None:
+        self._arrivals.append(time.perf_counter())
+
+    def track(self, response: Any) -> Iterator[Any]:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                self._arrivals.append(time.perf_counter())
+            self.usage(chunk)
+            yield chunk
+
+    async def atrack(self, response: Any) -> AsyncIterator[Any]:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                self._arrivals.append(time.perf_counter())
+            self.usage(chunk)
+            yield chunk
+
+    def usage(self, response: Any) -> None:
+        if not (usage := getattr(response, "usage", None)):
+            return
+        self.usage_tokens = getattr(usage, "completion_tokens", None)
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        # OpenAI style details, or Anthropic style fields
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cache_read_tokens = getattr(details, "cached_tokens", None)
+        if self.cache_read_tokens is None:
+            self.cache_read_tokens = getattr(usage, "cache_read_input_tokens", None)
+        self.cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None)
+
+    def timed(self, f: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self.render_seconds += time.perf_counter() - started
+
+        return wrapper
+
+    def summary(self) -> dict[str, Any]:
+        # Request timings start once the context is prepared
+        total = self._finished - self._requested
+        ttft = self._arrivals[0] - self._requested if self._arrivals else None
+        gaps = [b - a for a, b in zip(self._arrivals, self._arrivals[1:])]
+        # A cached answer is replayed at once, its parts are not tokens
+        tokens = self.usage_tokens or (None if self.cached else len(self._arrivals))
+        # Without streaming the whole response arrives at once
+        generation = total - ttft if len(self._arrivals) > 1 else total
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": self.model,
+            "cached": self.cached,
+            "settings_s": self.settings_seconds,
+            "import_s": self.import_seconds,
+            "context_s": self.context_seconds,
+            "send_s": self.send_seconds,
+            "ttft_s": ttft,
+            "gap_p50_s": percentile(gaps, 50),
+            "gap_p99_s": percentile(gaps, 99),
+            "prompt_tokens": self.prompt_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "tokens": tokens,
+            "tokens_per_s": tokens / generation if tokens and generation else None,
+            "total_s": total,
+            "render_s": self.render_seconds,
+        }
+
+    def report(self, metrics_file: Optional[Path] = None, show: bool = False) -> None:
+        summary = self.summary()
+        if metrics_file:
+            with open(metrics_file, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        if show:
+            from rich.console import Console
+
+            Console(stderr=True).print(
+                format_summary(summary), highlight=False, soft_wrap=True
+            )
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+def format_summary(s: dict[str, Any]) -> str:
+    rate = "-" if s["tokens_per_s"] is None else f"{s['tokens_per_s']:.1f}"
+    tokens = "" if s["tokens"] is None else f"{s['tokens']} tokens at {rate}/s, "
+    return (
+        f"[dim]{s['model']}{' (cached)' if s['cached'] else ''}: "
+        f"settings {_ms(s['settings_s'])}, import {_ms(s['import_s'])}, "
+        f"context {_ms(s['context_s'])}, "
+        f"send {_ms(s['send_s'])}, first token {_ms(s['ttft_s'])}, "
+        f"gaps p50 {_ms(s['gap_p50_s'])} p99 {_ms(s['gap_p99_s'])}, "
+        f"{tokens}total {_ms(s['total_s'])}, "
+        f"render {_ms(s['render_s'])}{_prompt(s)}[/dim]"
+    )
+
+
+def _prompt(s: dict[str, Any]) -> str:
+    if s["prompt_tokens"] is None:
+        return ""
+    cache = ""
+    if s["cache_read_tokens"] is not None or s["cache_write_tokens"] is not None:
+        cache = (
+            f" ({s['cache_read_tokens'] or 0} cached, "
+            f"{s['cache_write_tokens'] or 0} written to cache)"
+        )
+    return f", prompt {s['prompt_tokens']} tokens{cache}"
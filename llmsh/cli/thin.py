@@ -0,0 +1,192 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Entry point of the `llmsh` command. When `llmsh daemon` is running, the
+# request is handed over to it through a Unix socket and only the answer
+# is printed here. This module is imported on every invocation, so it
+# must stick to the standard library.
+
+import json
+import os
+import re
+import socket
+import stat
+import sys
+from typing import Any, Optional
+
+
+_markup_re = re.compile(r"\[/?[a-z0-9 #_.,-]*\]")
+# Variables that select the provider, its credentials and how it is
+# reached. The daemon answers only clients that agree with it on these.
+_provider_re = re.compile(
+    r"^(openai|azure|anthropic|aws|gemini|google|vertex|vertexai|palm|cohere|"
+    r"mistral|groq|hf|huggingface|ollama|together|togetherai|replicate|"
+    r"deepseek|xai|openrouter|perplexity|perplexityai|fireworks|litellm)_"
+    r"|_api_(key|base|version)$|_base_url$"
+    r"|^(http|https|all|no)_proxy$|^ssl_cert_|^requests_ca_bundle$",
+    re.IGNORECASE,
+)
+# Seconds to wait for the daemon to accept or decline a request
+_handshake_timeout = 5.0
+
+
+def socket_path() -> str:
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(base, f"llmsh-{os.getuid()}.sock")
+
+
+def provider_env(environ: Any) -> str:
+    # Digest of the provider variables, so that their values stay here
+    import hashlib
+
+    items = sorted((k, v) for k, v in environ.items() if _provider_re.search(k))
+    return hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()
+
+
+def owned_socket(path: str) -> bool:
+    # Anyone can create the socket first in a shared directory like /tmp
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def daemon_enabled() -> bool:
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+        return False
+    value = os.environ.get("LLMSH_DAEMON", "true").strip().lower()
+    return value not in ("0", "false", "no", "off")
+
+
+def _send(f: Any, message: dict) -> None:
+    f.write(json.dumps(message).encode("utf-8") + b"\n")
+    f.flush()
+
+
+def _print_error(message: str, tty: bool) -> None:
+    if tty:
+        from llmsh.cli.renderer import console
+
+        console.print(message)
+    else:
+        sys.stdout.write(_markup_re.sub("", message) + "\n")
+        sys.stdout.flush()
+
+
+def run_remote(args: list[str]) -> Optional[int]:
+    # Returns the exit code, or None if the request should run locally
+    path = socket_path()
+    if not owned_socket(path):
+        return None
+
+    is_pipe = not os.isatty(sys.stdin.fileno())
+    tty = os.isatty(sys.stdout.fileno())
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        # The daemon parses the arguments and decides whether it can
+        # handle the request before stdin is consumed.
+        try:
+            sock.settimeout(_handshake_timeout)
+            sock.connect(path)
+            f = sock.makefile("rwb")
+            _send(f, {
+                "argv": args,
+                "cwd": os.getcwd(),
+                "env": {k: v for k, v in os.environ.items() if k.startswith("LLMSH_")},
+                "provider": provider_env(os.environ),
+                "pipe": is_pipe,
+                "tty": tty,
+            })
+            reply = json.loads(f.readline() or b"null")
+        except (OSError, ValueError):
+            # Stale socket of a daemon that is no longer running, or one
+            # that doesn't answer in time
+            return None
+        if not reply or not reply.get("accept"):
+            return None
+        # The answer itself may take as long as the model needs
+        sock.settimeout(None)
+
+        if is_pipe:
+            data = sys.stdin.buffer.read()
+            _send(f, {"stdin": len(data)})
+            f.write(data)
+            f.flush()
+
+        if reply.get("raw"):
+            stream: Any = _RawOutput(sys.stdout.buffer, reply.get("flush_bytes", 0))
+        else:
+            from llmsh.cli.renderer import MarkdownStream, console
+
+            stream = MarkdownStream(console)
+
+        try:
+            with stream:
+                for line in f:
+                    message = json.loads(line)
+                    if "delta" in message:
+                        stream.feed(message["delta"])
+                    elif "error" in message:
+                        stream.flush()
+                        _print_error(message["error"], tty)
+                        return message.get("exit", 1)
+                    elif "exit" in message:
+                        return message["exit"]
+        except KeyboardInterrupt:
+            # Closing the socket makes the daemon cancel the request
+            return 130
+        except OSError:
+            pass
+
+    _print_error("[red]Connection to the daemon was lost.[/red]", tty)
+    return 1
+
+
+class _RawOutput:
+    # Same as renderer.RawStream, without importing rich
+
+    def __init__(self, file: Any, flush_bytes: int = 0) -> None:
+        self.flush_bytes = flush_bytes
+        self._file = file
+        self._pending = 0
+        self._last = ""
+
+    def __enter__(self) -> "_RawOutput":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self._last and not self._last.endswith("\n"):
+            self._file.write(b"\n")
+        self.flush()
+
+    def feed(self, part: str) -> None:
+        if not part:
+            return
+        self._last = part
+        self._pending += self._file.write(part.encode("utf-8"))
+        if self._pending >= self.flush_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+
+
+def run() -> None:
+    if daemon_enabled() and (code := run_remote(sys.argv[1:])) is not None:
+        sys.exit(code)
+
+    from llmsh.cli.app import run as run_local
+
+    run_local()
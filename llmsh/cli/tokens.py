@@ -0,0 +1,58 @@
+# Copyright 2024 Vagiz Duseev <vagiz@duseev.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Optional
+
+from llmsh.cli import utils
+from llmsh.models.message import Message
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self._litellm = utils.import_litellm()
+
+    def __call__(self, message: Message) -> int:
+        # Every message is tokenized once, the count is kept on the message
+        return message.token_count(self._count)
+
+    def _count(self, message: Message) -> int:
+        return self._litellm.token_counter(
+            model=self.model,
+            messages=[message.base()],
+        )
+
+    def context_window(self) -> Optional[int]:
+        try:
+            info = self._litellm.get_model_info(self.model)
+        except Exception:
+            logger.debug(f"Context window of {self.model} is unknown.")
+            return None
+        return info.get("max_input_tokens") or info.get("max_tokens")
+
+
+def context_budget(
+    counter: TokenCounter,
+    context_tokens: int,
+    max_tokens: Optional[int] = None,
+) -> int:
+    # The budget can't exceed the model's own context window, and the
+    # tokens reserved for the response don't count towards the prompt.
+    if window := counter.context_window():
+        context_tokens = min(context_tokens, window)
+    return context_tokens - (max_tokens or 0)
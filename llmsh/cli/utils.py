@@ -12,16 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from types import ModuleType
+from typing import Callable, Optional
 
 import typer
 
+from llmsh.cli.attach import AttachmentError, Attachments, attachment_limit
 from llmsh.cli.renderer import console
 from llmsh.models.message import Message
 from llmsh.settings import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+def import_litellm() -> ModuleType:
+    # litellm pulls in every provider SDK on import, which takes seconds.
+    # It is only imported once a request is actually about to be sent.
+    import litellm
+
+    litellm.suppress_debug_info = True
+    return litellm
+
+
 def check_file_exists(path: Path) -> None:
     if not path.exists():
         console.print(f"[red]File not found: {path}[/red]")
@@ -42,13 +58,27 @@ def safe_read_text(path: Path) -> str:
         raise typer.Exit(1)
 
 
-def read_if_path(prompt: Optional[str]) -> Optional[str]:
-    result: str | None = None
-    if prompt and prompt.startswith("@"):
-        path = Path(prompt[1:])
-        check_file_exists(path)
-        result = safe_read_text(path)
-    return result
+def read_if_path(
+    prompt: Optional[str], attachments: Optional[Attachments] = None
+) -> Optional[str]:
+    # Prompt with the referenced files attached, None if it has no references
+    if attachments is None:
+        attachments = Attachments(
+            attachment_limit(settings.attach_bytes, settings.context_tokens)
+        )
+    try:
+        result = attachments.expand(prompt)
+    except AttachmentError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+    return result if result != prompt else None
+
+
+@lru_cache(maxsize=16)
+def system_message(content: str) -> Message:
+    # The same system prompts are sent with every request, so their
+    # messages (and token counts) are reused between turns.
+    return Message(role=settings.system_role, content=content)
 
 
 def prepare_context(
@@ -56,18 +86,73 @@ def prepare_context(
     before: Optional[str] = None,
     after: Optional[str] = None,
     limit: Optional[int] = None,
-) -> list[str]:
-    prepared_messages = messages[-limit:] if limit else messages
-
+    budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[Message], int]] = None,
+    summary: Optional[Message] = None,
+    cache_marks: bool = False,
+) -> list[dict]:
+    prepared_messages = list(messages[-limit:] if limit else messages)
+    # Summary of the older messages that are not passed any more
+    leading = [summary] if summary else []
+
+    if budget is not None and count_tokens:
+        prepared_messages = trim_to_budget(
+            messages=prepared_messages,
+            system=[system_message(p) for p in (before, after) if p] + leading,
+            budget=budget,
+            count_tokens=count_tokens,
+        )
+
+    prepared_messages[:0] = leading
+    # The last message before the newest one ends the stable prefix
+    prefix_end = len(prepared_messages) - 2
     if before:
-        prepared_messages.insert(0, Message(role=settings.system_role, content=before))
+        prepared_messages.insert(0, system_message(before))
+        prefix_end += 1
     if after:
-        prepared_messages.append(Message(role=settings.system_role, content=after))
+        prepared_messages.append(system_message(after))
     
-    context = [m.base() for m in prepared_messages]
+    # Cached dicts of unchanged messages are reused, the list is new
+    context = [m.payload() for m in prepared_messages]
+
+    if cache_marks:
+        # Let the provider cache the system prompt and the older turns
+        for i in {0 if before else -1, prefix_end}:
+            if i >= 0:
+                context[i] = {**context[i], "cache_control": {"type": "ephemeral"}}
     return context
 
 
+def trim_to_budget(
+    messages: list[Message],
+    system: list[Message],
+    budget: int,
+    count_tokens: Callable[[Message], int],
+) -> list[Message]:
+    # System prompts and the latest message are always kept. Older messages
+    # are added from the newest to the oldest while they fit.
+    if not messages:
+        return messages
+
+    used = sum(count_tokens(m) for m in system) + count_tokens(messages[-1])
+    if used > budget:
+        logger.warning(
+            f"System prompts and the last message take {used} tokens, "
+            f"which is over the budget of {budget} tokens."
+        )
+
+    start = len(messages) - 1
+    while start > 0:
+        used += count_tokens(messages[start - 1])
+        if used > budget:
+            break
+        start -= 1
+
+    if start:
+        logger.debug(f"Dropped {start} oldest messages to fit {budget} tokens.")
+    return messages[start:]
+
+
 def get_user_prompt(prompt: str) -> str:
     result = ""
     if prompt.startswith("@"):
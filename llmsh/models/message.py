@@ -12,19 +12,115 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 from datetime import datetime
+from typing import Any, Callable, Optional
 
 from pydantic import BaseModel, Field
 
 
-class Message(BaseModel):
+class MessageRecord(BaseModel):
+    # A message as it is stored in a session log. Validation only happens
+    # here, when messages are read from or written to a file.
     role: str
     content: str
     timestamp: datetime = Field(default_factory=datetime.now)
+    model: Optional[str] = None
+    truncated: bool = False
+
+
+class Message:
+    """Chat message kept in memory.
+
+    A plain class with slots: chat histories can hold tens of thousands of
+    messages and every turn walks over them. The dict sent to the provider
+    and the token count are computed once and reused until the content
+    changes.
+    """
+
+    __slots__ = (
+        "role",
+        "_content",
+        "timestamp",
+        "model",
+        "truncated",
+        "_payload",
+        "_tokens",
+    )
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        timestamp: Optional[float] = None,
+        # Model that has written the message, if it is an answer
+        model: Optional[str] = None,
+        # The answer was cut short by the user
+        truncated: bool = False,
+    ) -> None:
+        self.role = role
+        self._content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.model = model
+        self.truncated = truncated
+        self._payload: Optional[dict[str, str]] = None
+        self._tokens: Optional[int] = None
+
+    @property
+    def content(self) -> str:
+        return self._content
+
+    @content.setter
+    def content(self, value: str) -> None:
+        self._content = value
+        self._payload = None
+        self._tokens = None
 
     def __str__(self) -> str:
-        t = self.timestamp.isoformat(timespec="seconds")
+        t = datetime.fromtimestamp(self.timestamp).isoformat(timespec="seconds")
         return f"({t}) {self.role}: {self.content}"
-    
-    def base(self) -> str:
-        return {"role": self.role, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def base(self) -> dict[str, str]:
+        # A new dict every time, safe to modify
+        return {"role": self.role, "content": self._content}
+
+    def payload(self) -> dict[str, str]:
+        # The same dict every time, must not be modified
+        if self._payload is None:
+            self._payload = self.base()
+        return self._payload
+
+    def token_count(self, count: Callable[["Message"], int]) -> int:
+        # Recount only if the content has changed since the last time
+        if self._tokens is None:
+            self._tokens = count(self)
+        return self._tokens
+
+    @classmethod
+    def from_record(cls, record: MessageRecord) -> "Message":
+        return cls(
+            role=record.role,
+            content=record.content,
+            timestamp=record.timestamp.timestamp(),
+            model=record.model,
+            truncated=record.truncated,
+        )
+
+    @classmethod
+    def from_json(cls, data: Any) -> "Message":
+        return cls.from_record(MessageRecord.model_validate_json(data))
+
+    def to_record(self) -> MessageRecord:
+        return MessageRecord.model_construct(
+            role=self.role,
+            content=self._content,
+            timestamp=datetime.fromtimestamp(self.timestamp),
+            model=self.model,
+            truncated=self.truncated,
+        )
+
+    def to_json(self) -> str:
+        return self.to_record().model_dump_json()
@@ -12,11 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from .settings import Settings
 
 
+_started = time.perf_counter()
 try:
     settings = Settings()
 except Exception as e:
     print(f"Failed to load settings: {e}")
     exit(1)
+# Reported by --stats
+load_seconds = time.perf_counter() - _started
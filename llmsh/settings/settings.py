@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from pathlib import Path
 from typing import Optional
 
 from pydantic import Field
@@ -35,11 +36,43 @@ class Settings(BaseSettings):
     before: Optional[str] = Field(_default_before_prompt)
     after: Optional[str] = Field(_default_after_prompt)
     model: str = Field("gpt-4")
+    fallback: Optional[str] = Field(None)
+    compare: Optional[str] = Field(None)
+    hedge_after: Optional[float] = Field(None)
     system_role: str = Field("system")
     user_role: str = Field("user")
     llm_role: str = Field("assistant")
     limit: Optional[int] = Field(None)
+    context_tokens: Optional[int] = Field(None)
+    attach_bytes: Optional[int] = Field(4 * 1024 * 1024)
+    compact: Optional[int] = Field(None)
+    compact_model: Optional[str] = Field(None)
+    prompt_cache: bool = Field(False)
     max_tokens: Optional[int] = Field(None)
+    retries: int = Field(3)
+    rate_limit: Optional[float] = Field(None)
     no_stream: bool = Field(False)
     interactive: bool = Field(False)
+    resume: Optional[str] = Field(None)
+    prewarm: bool = Field(True)
+    save: bool = Field(True)
     debug: bool = Field(False)
+    each_line: bool = Field(False)
+    each_record: bool = Field(False)
+    map_reduce: bool = Field(False)
+    chunk_tokens: int = Field(4000)
+    chunk_overlap: int = Field(0)
+    jobs: int = Field(4)
+    raw: bool = Field(False)
+    flush_bytes: int = Field(0)
+    workers: int = Field(8)
+    cache: bool = Field(False)
+    semantic_cache: bool = Field(False)
+    semantic_threshold: float = Field(0.98)
+    embedding_model: str = Field("local")
+    cache_ttl: int = Field(7 * 24 * 60 * 60)
+    cache_size: int = Field(256)
+    stats: bool = Field(False)
+    metrics_file: Optional[Path] = Field(None)
+    output_format: str = Field("text")
+    output: Optional[Path] = Field(None)